@@ -18,15 +18,28 @@
 import datetime
 import logging
 import multiprocessing
+import multiprocessing.pool
 import os
 import signal
+import time
 
 from tornado.ioloop import IOLoop
 
+import config
 import mediafiles
 import settings
+import utils
+import workers
 
 
+# how often (in seconds) to check whether a size quota is exceeded or the free space is too low
+_STORAGE_CHECK_INTERVAL = 60
+
+# the current storage check interval, doubled (up to CLEANUP_INTERVAL) each time an early cleanup
+# doesn't bring the storage back within limits (e.g. when files can't be removed)
+_storage_check_interval = _STORAGE_CHECK_INTERVAL
+_early_cleanup = False
+
 _process = None
 
 
@@ -37,6 +50,7 @@ def start():
     # schedule the first call a bit later to improve performance at startup
     io_loop = IOLoop.instance()
     io_loop.add_timeout(datetime.timedelta(seconds=min(settings.CLEANUP_INTERVAL, 60)), _run_process)
+    io_loop.add_timeout(datetime.timedelta(seconds=_STORAGE_CHECK_INTERVAL), _check_storage)
 
 
 def stop():
@@ -61,7 +75,6 @@ def running():
 
 
 def _run_process():
-    global _process
     
     io_loop = IOLoop.instance()
     
@@ -69,10 +82,59 @@ def _run_process():
     io_loop.add_timeout(datetime.timedelta(seconds=settings.CLEANUP_INTERVAL), _run_process)
 
     if not running(): # check that the previous process has finished
-        logging.debug('running cleanup process...')
+        _start_process()
+
+
+def _start_process():
+    global _process
+
+    logging.debug('running cleanup process...')
+
+    _process = multiprocessing.Process(target=_do_cleanup)
+    _process.start()
+
+
+def _check_storage():
+    if running():
+        IOLoop.instance().add_timeout(datetime.timedelta(seconds=_storage_check_interval), _check_storage)
+        return
+
+    # the index is queried and the file systems are stat'ed in a worker thread, away from the IO loop
+    future = workers.submit(mediafiles.needs_quota_cleanup, _STORAGE_CHECK_INTERVAL)
+    IOLoop.instance().add_future(future, _on_storage_checked)
+
+
+def _on_storage_checked(future):
+    global _storage_check_interval
+    global _early_cleanup
+
+    try:
+        exceeded = future.result()
+
+    except workers.TimeoutError:
+        logging.error('timeout waiting for the media storage check')
+        exceeded = False
+
+    except Exception:
+        exceeded = False # already logged by the worker
+
+    if not exceeded:
+        _storage_check_interval = _STORAGE_CHECK_INTERVAL
+        _early_cleanup = False
+
+    elif _early_cleanup: # the previous early cleanup freed nothing, or not enough
+        _storage_check_interval = min(_storage_check_interval * 2,
+                max(settings.CLEANUP_INTERVAL, _STORAGE_CHECK_INTERVAL))
 
-        _process = multiprocessing.Process(target=_do_cleanup)
-        _process.start()
+        logging.debug('media storage limits still exceeded, next check in %s seconds' % _storage_check_interval)
+
+    # schedule the next call
+    IOLoop.instance().add_timeout(datetime.timedelta(seconds=_storage_check_interval), _check_storage)
+
+    if exceeded and not running():
+        logging.debug('media storage limits exceeded, cleaning up early')
+        _early_cleanup = True
+        _start_process()
 
 
 def _do_cleanup():
@@ -82,11 +144,66 @@ def _do_cleanup():
     signal.signal(signal.SIGINT, signal.SIG_IGN)
     signal.signal(signal.SIGTERM, signal.SIG_IGN)
     
+    # cleanup must not slow down motion writing to the same disks
+    utils.set_idle_io_priority()
+
+    started = time.time()
+
     try:
-        mediafiles.cleanup_media('picture')
-        mediafiles.cleanup_media('movie')
-        logging.debug('cleanup done')
-         
+        # each storage device is cleaned up in its own thread, so that slow disks or network shares
+        # don't hold back the others
+        devices = _get_camera_devices()
+        pool = multiprocessing.pool.ThreadPool(max(1, min(settings.CLEANUP_CONCURRENCY, len(devices))),
+                utils.set_idle_io_priority)
+
+        pool.map(_cleanup_device, devices.values())
+        pool.close()
+        pool.join()
+
+        mediafiles.cleanup_media_quota()
+        logging.debug('cleanup done in %.3fs' % (time.time() - started))
+
     except Exception as e:
         logging.error('failed to cleanup media files: %(msg)s' % {
                 'msg': unicode(e)}, exc_info=True)
+
+
+def _get_camera_devices():
+    # groups the local cameras by the device their media files are stored on
+    devices = {}
+    for camera_id in config.get_camera_ids():
+        camera_config = config.get_camera(camera_id)
+        if not utils.is_local_motion_camera(camera_config):
+            continue
+
+        try:
+            device = os.stat(camera_config['target_dir']).st_dev
+
+        except OSError:
+            device = camera_config['target_dir']
+
+        devices.setdefault(device, []).append(camera_config)
+
+    return devices
+
+
+def _cleanup_device(camera_configs):
+    started = time.time()
+    for i, camera_config in enumerate(camera_configs):
+        logging.debug('cleaning up media files of camera %(id)s (%(index)s/%(count)s on its device)...' % {
+                'id': camera_config['@id'], 'index': i + 1, 'count': len(camera_configs)})
+
+        camera_started = time.time()
+        for media_type in ['picture', 'movie']:
+            try:
+                mediafiles.cleanup_camera_media(camera_config, media_type)
+
+            except Exception as e:
+                logging.error('failed to cleanup %(media_type)ss of camera %(id)s: %(msg)s' % {
+                        'media_type': media_type, 'id': camera_config['@id'], 'msg': unicode(e)}, exc_info=True)
+
+        logging.debug('media files of camera %(id)s cleaned up in %(time).3fs' % {
+                'id': camera_config['@id'], 'time': time.time() - camera_started})
+
+    logging.debug('media files of cameras %(ids)s (on the same device) cleaned up in %(time).3fs' % {
+            'ids': ', '.join([str(c['@id']) for c in camera_configs]), 'time': time.time() - started})
@@ -696,6 +696,7 @@ def motion_camera_ui_to_dict(ui, old_config=None):
         '@network_share_name': ui['network_share_name'],
         '@network_username': ui['network_username'],
         '@network_password': ui['network_password'],
+        '@max_media_size': max(0, int(float(ui.get('max_media_size') or 0))),
         '@upload_enabled': ui['upload_enabled'],
         '@upload_movie': ui['upload_movie'],
         '@upload_picture': ui['upload_picture'],
@@ -1053,6 +1054,7 @@ def motion_camera_ui_to_dict(ui, old_config=None):
 
 
 def motion_camera_dict_to_ui(data):
+    import mediafiles
     import smbctl
     
     ui = {
@@ -1074,6 +1076,7 @@ def motion_camera_dict_to_ui(data):
         'disk_used': 0,
         'disk_total': 0,
         'available_disks': diskctl.list_mounted_disks(),
+        'max_media_size': data['@max_media_size'],
         'upload_enabled': data['@upload_enabled'],
         'upload_picture': data['@upload_picture'],
         'upload_movie': data['@upload_movie'],
@@ -1247,6 +1250,9 @@ def motion_camera_dict_to_ui(data):
     if usage:
         ui['disk_used'], ui['disk_total'] = usage
 
+    # the storage used by this camera alone
+    ui['media_usage'] = mediafiles.get_cached_media_usage(data)
+
     text_left = data['text_left']
     text_right = data['text_right'] 
     if text_left or text_right:
@@ -1897,6 +1903,7 @@ def _set_default_motion_camera(camera_id, data):
         data.setdefault('ffmpeg_variable_bitrate', _EXPONENTIAL_DEF_QUALITY)
 
     data.setdefault('@preserve_movies', 0)
+    data.setdefault('@max_media_size', 0)
     
     data.setdefault('@working_schedule', '')
     data.setdefault('@working_schedule_type', 'outside')
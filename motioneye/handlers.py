@@ -16,19 +16,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>. 
 
 import datetime
+import functools
 import hashlib
 import json
 import logging
 import os
 import re
 import socket
+import struct
 import subprocess
+import time
 
-from tornado.ioloop import IOLoop
+from tornado.ioloop import IOLoop, PeriodicCallback
 from tornado.web import RequestHandler, HTTPError, asynchronous
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
 
 import config
 import mediafiles
+import mediawatch
 import mjpgclient
 import monitor
 import motionctl
@@ -46,6 +51,14 @@ import v4l2ctl
 
 
 class BaseHandler(RequestHandler):
+    # the time from which the next frame of a camera may be sent to a viewer, indexed by (viewer, camera id);
+    # a viewer is a user at a given address, so that the limit holds across all of its connections
+    _frame_slots = {}
+    _frame_slots_pruned = 0
+
+    # how often (in seconds) the frame slots of the viewers gone away are forgotten
+    _FRAME_SLOTS_PRUNE_INTERVAL = 60
+
     def get_all_arguments(self):
         keys = self.request.arguments.keys()
         arguments = dict([(key, self.get_argument(key)) for key in keys])
@@ -90,6 +103,215 @@ class BaseHandler(RequestHandler):
         
         return argument
     
+    def get_list_params(self):
+        # pagination and time range arguments of the media list requests
+        params = {}
+        try:
+            limit = self.get_argument('limit', None)
+            if limit is not None:
+                params['limit'] = int(limit)
+                if params['limit'] <= 0:
+                    raise ValueError('limit must be positive')
+
+            for name in ['since', 'until']:
+                value = self.get_argument(name, None)
+                if value is not None:
+                    params[name] = float(value)
+
+            cursor = self.get_argument('cursor', None)
+            if cursor:
+                mediafiles.parse_list_cursor(cursor)
+                params['cursor'] = cursor
+
+        except ValueError as e:
+            raise HTTPError(400, unicode(e))
+
+        order = self.get_argument('order', None)
+        if order is not None:
+            if order not in ['asc', 'desc']:
+                raise HTTPError(400, 'invalid order: %s' % order)
+
+            params['order'] = order
+
+        format = self.get_argument('format', None)
+        if format is not None:
+            if format not in ['full', 'compact']:
+                raise HTTPError(400, 'invalid format: %s' % format)
+
+            if format == 'compact' and self.get_argument('stream', None) == 'true':
+                raise HTTPError(400, 'the compact format can\'t be streamed')
+
+            params['format'] = format
+
+        return params
+
+    def stream_media_list(self, camera_config, media_type, prefix, params):
+        # writes the media list to the client as it is produced, in chunks,
+        # instead of collecting all of it before answering
+        self.set_header('Content-Type', 'application/json')
+        self.write('{"cameraName": %s, "mediaList": [' % json.dumps(camera_config['@name']))
+        self.flush()
+
+        state = {'count': 0, 'last': None}
+
+        def on_chunk(entries):
+            chunk = ', '.join([json.dumps(e) for e in entries])
+            if state['count']:
+                chunk = ', ' + chunk
+
+            state['count'] += len(entries)
+            state['last'] = entries[-1]
+
+            self.write(chunk)
+            self.flush()
+
+        def on_media_list(media_list):
+            tail = ']'
+            if media_list is None:
+                # the status has already been sent, so the error can only be reported in the body
+                tail += ', "error": %s' % json.dumps('Failed to get %ss list.' % media_type)
+
+            elif params.get('limit'):
+                full = state['count'] >= params['limit']
+                cursor = full and mediafiles.make_list_cursor(state['last']['path'], state['last']['timestamp']) or None
+                tail += ', "nextCursor": %s' % json.dumps(cursor)
+
+            self.finish(tail + '}')
+
+        mediafiles.list_media(camera_config, media_type=media_type, callback=on_media_list,
+                prefix=prefix, chunk_callback=on_chunk, **params)
+
+    def delete_media_group(self, camera_id, group, media_type):
+        # the files are deleted by a background job; with background=true, the id of the job is returned
+        # right away, otherwise the response is sent when the job is done; with job=<id>&cancel=true,
+        # the given job is cancelled instead
+        camera_config = config.get_camera(camera_id)
+        job_id = self.get_argument('job', None)
+        cancel = self.get_argument('cancel', None) == 'true'
+        background = self.get_argument('background', None) == 'true'
+
+        if utils.is_local_motion_camera(camera_config):
+            if job_id and cancel:
+                if not mediafiles.cancel_media_group_deletion(job_id):
+                    raise HTTPError(404, 'no such job')
+
+                return self.finish_json(mediafiles.check_media_group_deletion(job_id))
+
+            def on_deleted(error):
+                if error:
+                    self.finish_json({'error': error})
+
+                else:
+                    self.finish_json()
+
+            if background:
+                job_id = mediafiles.start_media_group_deletion(camera_config, group, media_type)
+                self.finish_json(mediafiles.check_media_group_deletion(job_id))
+
+            else:
+                mediafiles.start_media_group_deletion(camera_config, group, media_type, callback=on_deleted)
+
+        elif utils.is_remote_camera(camera_config):
+            def on_response(response=None, error=None):
+                if error:
+                    return self.finish_json({'error': 'Failed to delete %(media_type)s group at %(url)s: %(msg)s.' % {
+                            'media_type': media_type, 'url': remote.pretty_camera_url(camera_config), 'msg': error}})
+
+                if background and not (response or {}).get('jobId'):
+                    # older remote motionEye, deleting the group before answering
+                    response = {'progress': 1, 'done': True}
+
+                self.finish_json(response or {})
+
+            if job_id and cancel:
+                remote.cancel_media_group_deletion(camera_config, group=group, media_type=media_type,
+                        job_id=job_id, callback=on_response)
+
+            else:
+                remote.del_media_group(camera_config, group=group, media_type=media_type,
+                        background=background, callback=on_response)
+
+        else: # assuming simple mjpeg camera
+            raise HTTPError(400, 'unknown operation')
+
+    def check_media_group_deletion(self, camera_id, group, media_type):
+        job_id = self.get_argument('job', None)
+        if not job_id:
+            raise HTTPError(400, 'missing job id')
+
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config):
+            status = mediafiles.check_media_group_deletion(job_id)
+            if status is None:
+                raise HTTPError(404, 'no such job')
+
+            self.finish_json(status)
+
+        elif utils.is_remote_camera(camera_config):
+            def on_response(response=None, error=None):
+                if error:
+                    return self.finish_json({'error': 'Failed to check %(media_type)s group deletion at %(url)s: %(msg)s.' % {
+                            'media_type': media_type, 'url': remote.pretty_camera_url(camera_config), 'msg': error}})
+
+                self.finish_json(response)
+
+            remote.check_media_group_deletion(camera_config, group=group, media_type=media_type,
+                    job_id=job_id, callback=on_response)
+
+        else: # assuming simple mjpeg camera
+            raise HTTPError(400, 'unknown operation')
+
+    def delete_media_files(self, camera_id, media_type):
+        # the files are given either as a list of paths, or as a time range
+        paths = self.get_argument('paths', None)
+        since = self.get_argument('since', None)
+        until = self.get_argument('until', None)
+
+        if paths is not None:
+            if not isinstance(paths, list) or [p for p in paths if not isinstance(p, basestring)]:
+                raise HTTPError(400, 'paths must be a list of strings')
+
+            if since is not None or until is not None:
+                raise HTTPError(400, 'paths and time range are mutually exclusive')
+
+        elif since is None and until is None:
+            raise HTTPError(400, 'either paths or a time range is required')
+
+        try:
+            if since is not None:
+                since = float(since)
+
+            if until is not None:
+                until = float(until)
+
+        except ValueError as e:
+            raise HTTPError(400, unicode(e))
+
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config):
+            def on_deleted(result):
+                if result is None:
+                    return self.finish_json({'error': 'Failed to delete %ss.' % media_type})
+
+                self.finish_json(result)
+
+            mediafiles.del_media_files(camera_config, media_type, callback=on_deleted,
+                    paths=paths, since=since, until=until)
+
+        elif utils.is_remote_camera(camera_config):
+            def on_response(response=None, error=None):
+                if error:
+                    return self.finish_json({'error': 'Failed to delete %(media_type)ss at %(url)s: %(msg)s.' % {
+                            'media_type': media_type, 'url': remote.pretty_camera_url(camera_config), 'msg': error}})
+
+                self.finish_json(response)
+
+            remote.del_media_files(camera_config, media_type=media_type, paths=paths, since=since, until=until,
+                    callback=on_response)
+
+        else: # assuming simple mjpeg camera
+            raise HTTPError(400, 'unknown operation')
+
     def finish(self, chunk=None):
         import motioneye
 
@@ -143,12 +365,54 @@ class BaseHandler(RequestHandler):
         
     def set_pref(self, key, value):
         return prefs.set(self.current_user or 'anonymous', key, value)
+
+    def get_frame_delay(self, camera_id):
+        # the number of seconds before the next frame of the camera may be sent to this viewer
+        viewer = self._get_viewer()
+        if viewer is None:
+            return 0
+
+        return max(BaseHandler._frame_slots.get((viewer, camera_id), 0) - time.time(), 0)
+
+    def reserve_frame(self, camera_id, max_rate=None):
+        # takes the next frame slot of the camera for this viewer, so that frames are delivered at most at
+        # MAX_VIEWER_FRAME_RATE (or max_rate, if lower) per second; returns the number of seconds to wait
+        # before sending the frame
+        rate = settings.MAX_VIEWER_FRAME_RATE
+        if max_rate > 0:
+            rate = min(rate, max_rate) if rate else max_rate
+
+        viewer = self._get_viewer()
+        if not rate or viewer is None:
+            return 0
+
+        now = time.time()
+        if now - BaseHandler._frame_slots_pruned > self._FRAME_SLOTS_PRUNE_INTERVAL:
+            for key, slot in BaseHandler._frame_slots.items():
+                if slot < now:
+                    del BaseHandler._frame_slots[key]
+
+            BaseHandler._frame_slots_pruned = now
+
+        key = (viewer, camera_id)
+        slot = max(BaseHandler._frame_slots.get(key, 0), now)
+        BaseHandler._frame_slots[key] = slot + 1.0 / rate
+
+        return slot - now
+
+    def _get_viewer(self):
+        # requests made by a hub (signed with the admin credentials, with _admin) carry the frames
+        # of all its viewers, so they are not governed here, but by the hub itself
+        if self.get_argument('_admin', None) == 'true' and self.current_user == 'admin':
+            return None
+
+        return (self.current_user, self.request.remote_ip)
         
     def _handle_request_exception(self, exception):
         try:
             if isinstance(exception, HTTPError):
                 logging.error(str(exception))
-                self.set_status(exception.status_code)
+                self.set_status(exception.status_code, reason=exception.reason) # reason is needed by unusual codes
                 self.finish_json({'error': exception.log_message or getattr(exception, 'reason', None) or str(exception)})
             
             else:
@@ -254,6 +518,9 @@ class ConfigHandler(BaseHandler):
         elif op == 'authorize':
             self.authorize(camera_id)
 
+        elif op == 'usage':
+            self.usage(camera_id)
+
         else:
             raise HTTPError(400, 'unknown operation')
     
@@ -283,6 +550,63 @@ class ConfigHandler(BaseHandler):
         else:
             raise HTTPError(400, 'unknown operation')
     
+    @BaseHandler.auth(admin=True)
+    def usage(self, camera_id):
+        # the storage used by the media files of one camera, or of all cameras
+        if camera_id is not None:
+            logging.debug('getting media usage for camera %(id)s' % {'id': camera_id})
+
+            if camera_id not in config.get_camera_ids():
+                raise HTTPError(404, 'no such camera')
+
+            camera_ids = [camera_id]
+
+        else:
+            logging.debug('getting media usage for all cameras')
+
+            camera_ids = config.get_camera_ids()
+
+        cameras = []
+        length = [0]
+
+        def check_finished():
+            if len(cameras) == length[0]:
+                cameras.sort(key=lambda c: c['id'])
+                if camera_id is not None:
+                    self.finish_json(cameras[0])
+
+                else:
+                    self.finish_json({'cameras': cameras})
+
+        def on_usage_builder(camera_id, camera_config):
+            def on_usage(usage=None, error=None):
+                camera = {'id': camera_id, 'name': camera_config['@name']}
+                if usage is None:
+                    camera['error'] = error or 'Failed to get media usage.'
+
+                else:
+                    camera['usage'] = usage
+
+                cameras.append(camera)
+                check_finished()
+
+            return on_usage
+
+        for cid in camera_ids:
+            camera_config = config.get_camera(cid)
+            if utils.is_local_motion_camera(camera_config):
+                length[0] += 1
+                mediafiles.get_media_usage(camera_config, on_usage_builder(cid, camera_config))
+
+            elif utils.is_remote_camera(camera_config):
+                length[0] += 1
+                remote.get_media_usage(camera_config, on_usage_builder(cid, camera_config))
+
+        if camera_id is not None and not length[0]: # assuming simple mjpeg camera
+            raise HTTPError(400, 'unknown operation')
+
+        check_finished()
+
     @BaseHandler.auth(admin=True)
     def get_config(self, camera_id):
         if camera_id:
@@ -908,8 +1232,13 @@ class ConfigHandler(BaseHandler):
 
 
 class PictureHandler(BaseHandler):
+    _STREAM_BOUNDARY = 'motioneyeframe'
+    _MAX_MOSAIC_SIZE = 4096
+    _FIRST_FRAME_TIMEOUT = 5
+    _MAX_FRAME_DELAY = 1 # seconds
+
     @asynchronous
-    def get(self, camera_id, op, filename=None, group=None):
+    def get(self, camera_id=None, op=None, filename=None, group=None):
         if camera_id is not None:
             camera_id = int(camera_id)
             if camera_id not in config.get_camera_ids():
@@ -921,9 +1250,21 @@ class PictureHandler(BaseHandler):
         elif op == 'list':
             self.list(camera_id)
             
+        elif op == 'groups':
+            self.groups(camera_id)
+
         elif op == 'frame':
             self.frame(camera_id)
             
+        elif op == 'stream':
+            self.stream(camera_id)
+            
+        elif op == 'history':
+            self.history(camera_id)
+
+        elif op == 'mosaic':
+            self.mosaic()
+
         elif op == 'download':
             self.download(camera_id, filename)
         
@@ -936,6 +1277,12 @@ class PictureHandler(BaseHandler):
         elif op == 'timelapse':
             self.timelapse(camera_id, group)
         
+        elif op == 'delete_all':
+            if group == '/': # ungrouped
+                group = ''
+
+            self.delete_all_status(camera_id, group)
+
         else:
             raise HTTPError(400, 'unknown operation')
     
@@ -955,37 +1302,58 @@ class PictureHandler(BaseHandler):
         elif op == 'delete_all':
             self.delete_all(camera_id, group)
         
+        elif op == 'delete_many':
+            self.delete_many(camera_id)
+
         else:
             raise HTTPError(400, 'unknown operation')
     
     @BaseHandler.auth(prompt=False)
-    def current(self, camera_id, retry=0):
+    def current(self, camera_id, delayed=False):
         self.set_header('Content-Type', 'image/jpeg')
         
         width = self.get_argument('width', None)
         height = self.get_argument('height', None)
+        after = self.get_argument('after', None)
         
         width = width and float(width)
         height = height and float(height)
+
+        try:
+            after = int(after) if after else None
+
+        except ValueError:
+            raise HTTPError(400, 'invalid after parameter')
         
         camera_id_str = str(camera_id)
         
         camera_config = config.get_camera(camera_id)
+        if not delayed and (utils.is_local_motion_camera(camera_config) or utils.is_remote_camera(camera_config)):
+            # frames are served to each viewer at a limited rate; early requests are held until their turn,
+            # while those of a viewer already too far ahead are refused
+            if self.get_frame_delay(camera_id) > self._MAX_FRAME_DELAY:
+                raise HTTPError(429, 'too many frame requests', reason='Too Many Requests')
+
+            delay = self.reserve_frame(camera_id, camera_config.get('stream_maxrate'))
+            if delay:
+                return IOLoop.instance().add_timeout(datetime.timedelta(seconds=delay), self.current,
+                                                     camera_id=camera_id, delayed=True)
+
         if utils.is_local_motion_camera(camera_config):
-            picture = mediafiles.get_current_picture(camera_config, width=width, height=height)
+            jpg, seq = mjpgclient.get_frame(camera_id)
             
             # picture is not available usually when the corresponding internal mjpeg client has been closed;
-            # get_current_picture() will make sure to start a client, but a jpeg frame is not available right away;
-            # wait at most 5 seconds and retry every 200 ms.
-            if not picture and retry < 25:
-                return IOLoop.instance().add_timeout(datetime.timedelta(seconds=0.2), self.current,
-                                                     camera_id=camera_id, retry=retry + 1)
+            # get_frame() will make sure to start a client, but a jpeg frame is not available right away;
+            # wait for the first frame, at most _FIRST_FRAME_TIMEOUT seconds
+            if jpg is None:
+                return self._wait_current(camera_config, width, height, self._FIRST_FRAME_TIMEOUT)
             
-            self.set_cookie('motion_detected_' + camera_id_str, str(motionctl.is_motion_detected(camera_id)).lower())
-            self.set_cookie('capture_fps_' + camera_id_str, '%.1f' % mjpgclient.get_fps(camera_id))
-            self.set_cookie('monitor_info_' + camera_id_str, monitor.get_monitor_info(camera_id))
+            if after == seq:
+                # the client already has this frame; hold the request until a newer one arrives
+                # (a client that is ahead, e.g. with a sequence number from before a restart, gets this frame)
+                return self._wait_current(camera_config, width, height, settings.MJPG_CLIENT_TIMEOUT)
 
-            self.try_finish(picture)
+            self._finish_current(camera_config, jpg, seq, width, height)
 
         elif utils.is_remote_camera(camera_config):
             def on_response(motion_detected=False, capture_fps=None, monitor_info=None, picture=None, error=None):
@@ -1002,25 +1370,322 @@ class PictureHandler(BaseHandler):
             
         else: # assuming simple mjpeg camera
             raise HTTPError(400, 'unknown operation')
-            
+
+    @BaseHandler.auth(prompt=False)
+    def stream(self, camera_id):
+        # pushes the frames of the camera to the client as they arrive, over a single connection;
+        # a client that doesn't keep up only gets the most recent frame once it's ready for more
+        width = self.get_argument('width', None)
+        height = self.get_argument('height', None)
+
+        width = width and float(width)
+        height = height and float(height)
+
+        camera_config = config.get_camera(camera_id)
+        if not utils.is_local_motion_camera(camera_config):
+            raise HTTPError(400, 'unknown operation')
+
+        io_loop = IOLoop.instance()
+        state = {'busy': False, 'pending': None}
+
+        def on_jpg(jpg, seq):
+            if self.request.connection.stream.closed():
+                return
+
+            state['pending'] = (jpg, seq) # the older pending frame, if any, is dropped
+            if state['busy']: # still writing the previous frame or waiting for the turn of this one
+                return
+
+            state['busy'] = True
+            delay = self.reserve_frame(camera_id, camera_config.get('stream_maxrate'))
+            if delay:
+                io_loop.add_timeout(datetime.timedelta(seconds=delay), send_pending)
+
+            else:
+                send_pending()
+
+        def send_pending():
+            if self.request.connection.stream.closed():
+                return
+
+            (jpg, seq), state['pending'] = state['pending'], None
+            if width or height:
+                jpg = mediafiles.resize_frame(camera_config, jpg, seq, width, height)
+
+            self.write('--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %s\r\n\r\n' % (
+                    self._STREAM_BOUNDARY, len(jpg)))
+            self.write(jpg)
+            self.write('\r\n')
+            self.flush(callback=on_flushed)
+
+        def on_flushed():
+            state['busy'] = False
+            pending, state['pending'] = state['pending'], None
+            if pending:
+                on_jpg(*pending)
+
+        if not mjpgclient.subscribe(camera_id, on_jpg):
+            raise HTTPError(400, 'camera %s can\'t be streamed' % camera_id)
+
+        logging.debug('streaming camera %(id)s to %(client)s' % {'id': camera_id, 'client': self.request.remote_ip})
+
+        self._stream_callback = (camera_id, on_jpg)
+
+        self.set_header('Content-Type', 'multipart/x-mixed-replace; boundary=%s' % self._STREAM_BOUNDARY)
+        self.set_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+        self.set_header('Pragma', 'no-cache')
+        last_jpg, last_seq = mjpgclient.get_frame(camera_id)
+        if last_jpg:
+            on_jpg(last_jpg, last_seq)
+
+        else:
+            self.flush()
+
+    @BaseHandler.auth(prompt=False)
+    def mosaic(self):
+        # the last frames of several local cameras composed into one picture;
+        # with stream=true, the mosaic is pushed as a multipart stream, at most fps times per second
+        camera_ids = self.get_argument('ids', None)
+        try:
+            width = int(self.get_argument('width', 640))
+            height = int(self.get_argument('height', 480))
+            fps = float(self.get_argument('fps', 1))
+            if camera_ids:
+                camera_ids = [int(i) for i in camera_ids.split(',')]
+
+        except ValueError:
+            raise HTTPError(400, 'invalid mosaic parameters')
+
+        if width <= 0 or height <= 0 or not fps > 0:
+            raise HTTPError(400, 'invalid mosaic parameters')
+
+        if not camera_ids:
+            camera_ids = config.get_camera_ids()
+
+        local_camera_ids = []
+        for camera_id in camera_ids:
+            if camera_id not in config.get_camera_ids():
+                raise HTTPError(404, 'no such camera')
+
+            camera_config = config.get_camera(camera_id)
+            if camera_config['@enabled'] and utils.is_local_motion_camera(camera_config):
+                local_camera_ids.append(camera_id)
+
+        if not local_camera_ids:
+            raise HTTPError(400, 'no local cameras')
+
+        width = min(max(width, 16), self._MAX_MOSAIC_SIZE)
+        height = min(max(height, 16), self._MAX_MOSAIC_SIZE)
+
+        if self.get_argument('stream', None) != 'true':
+            if self.get_frame_delay('mosaic') > self._MAX_FRAME_DELAY:
+                raise HTTPError(429, 'too many frame requests', reason='Too Many Requests')
+
+            def finish_mosaic():
+                self.set_header('Content-Type', 'image/jpeg')
+                self.set_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                self.try_finish(mediafiles.get_mosaic(local_camera_ids, width, height))
+
+            delay = self.reserve_frame('mosaic')
+            if delay:
+                return IOLoop.instance().add_timeout(datetime.timedelta(seconds=delay), finish_mosaic)
+
+            return finish_mosaic()
+
+        io_loop = IOLoop.instance()
+        interval = 1.0 / min(max(fps, 0.1), 30)
+        state = {'jpg': None, 'time': 0}
+
+        def send_mosaic():
+            if self.request.connection.stream.closed():
+                return
+
+            state['time'] = time.time()
+            jpg = mediafiles.get_mosaic(local_camera_ids, width, height)
+            if jpg is state['jpg']: # no new frame since the last one, nothing sent, no frame slot taken
+                return io_loop.add_timeout(state['time'] + interval, send_mosaic)
+
+            state['jpg'] = jpg
+            self.write('--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %s\r\n\r\n' % (
+                    self._STREAM_BOUNDARY, len(jpg)))
+            self.write(jpg)
+            self.write('\r\n')
+            self.flush(callback=on_flushed)
+
+        def on_flushed():
+            delay = self.reserve_frame('mosaic')
+            io_loop.add_timeout(max(state['time'] + interval, time.time() + delay), send_mosaic)
+
+        logging.debug('streaming mosaic of cameras %(ids)s to %(client)s' % {
+                'ids': ', '.join(str(i) for i in local_camera_ids), 'client': self.request.remote_ip})
+
+        self.set_header('Content-Type', 'multipart/x-mixed-replace; boundary=%s' % self._STREAM_BOUNDARY)
+        self.set_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+        self.set_header('Pragma', 'no-cache')
+
+        send_mosaic()
+
+    @BaseHandler.auth(prompt=False)
+    def history(self, camera_id):
+        # returns the recent frames of the camera, either replayed at their own pace
+        # as a multipart stream, or as a zip file
+        start = self.get_argument('from', None)
+        end = self.get_argument('to', None)
+        width = self.get_argument('width', None)
+        height = self.get_argument('height', None)
+
+        try:
+            start = float(start) if start else None
+            end = float(end) if end else None
+            width = width and float(width)
+            height = height and float(height)
+
+        except ValueError:
+            raise HTTPError(400, 'invalid history parameters')
+
+        if (width is not None and not width > 0) or (height is not None and not height > 0):
+            raise HTTPError(400, 'invalid history parameters')
+
+        camera_config = config.get_camera(camera_id)
+        if not utils.is_local_motion_camera(camera_config):
+            raise HTTPError(400, 'unknown operation')
+
+        if not settings.FRAME_HISTORY_DURATION:
+            raise HTTPError(400, 'frame history is disabled')
+
+        frames = mjpgclient.get_history(camera_id, start, end)
+        if not frames:
+            raise HTTPError(404, 'no frames')
+
+        logging.debug('serving %(count)s history frames of camera %(id)s to %(client)s' % {
+                'count': len(frames), 'id': camera_id, 'client': self.request.remote_ip})
+
+        if self.get_argument('zip', None) == 'true':
+            def on_zip(data):
+                if data is None:
+                    return self.finish_json({'error': 'Failed to create zip file.'})
+
+                pretty_filename = camera_config['@name'] + '_' + datetime.datetime.fromtimestamp(
+                        frames[0][0]).strftime('%Y%m%d_%H%M%S')
+                pretty_filename = re.sub('[^a-zA-Z0-9]', '_', pretty_filename)
+
+                self.set_header('Content-Type', 'application/zip')
+                self.set_header('Content-Disposition', 'attachment; filename=' + pretty_filename + '.zip;')
+                self.finish(data)
+
+            return mediafiles.get_zipped_frames(camera_config, frames, width, height, callback=on_zip)
+
+        io_loop = IOLoop.instance()
+        started = time.time()
+
+        def send_frame(index):
+            if self.request.connection.stream.closed():
+                return
+
+            if index >= len(frames):
+                return self.finish()
+
+            jpg = mediafiles.resize_picture(camera_config, frames[index][2], width, height)
+            self.write('--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %s\r\n\r\n' % (
+                    self._STREAM_BOUNDARY, len(jpg)))
+            self.write(jpg)
+            self.write('\r\n')
+            self.flush(callback=functools.partial(on_flushed, index + 1))
+
+        def on_flushed(index):
+            if index >= len(frames):
+                return send_frame(index)
+
+            # keep the original pace of the frames, unless the client is slower than that
+            due = started + frames[index][0] - frames[0][0]
+            delay = self.reserve_frame(camera_id)
+            io_loop.add_timeout(max(due, time.time() + delay), functools.partial(send_frame, index))
+
+        self.set_header('Content-Type', 'multipart/x-mixed-replace; boundary=%s' % self._STREAM_BOUNDARY)
+        self.set_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+        self.set_header('Pragma', 'no-cache')
+
+        send_frame(0)
+
+    def on_connection_close(self):
+        stream_callback = getattr(self, '_stream_callback', None)
+        if stream_callback:
+            logging.debug('stopped streaming camera %(id)s to %(client)s' % {
+                    'id': stream_callback[0], 'client': self.request.remote_ip})
+
+            mjpgclient.unsubscribe(*stream_callback)
+            self._stream_callback = None
+
+    def _wait_current(self, camera_config, width, height, timeout):
+        # finishes the request with the next frame of the camera, as soon as it arrives;
+        # after timeout seconds, the current frame (if any) is used instead
+        camera_id = camera_config['@id']
+
+        def on_frame(future):
+            if self.request.connection.stream.closed():
+                return
+
+            jpg, seq = future.result()
+            if jpg is None:
+                jpg, seq = mjpgclient.get_frame(camera_id)
+
+            self._finish_current(camera_config, jpg, seq, width, height)
+
+        IOLoop.instance().add_future(mjpgclient.wait_frame(camera_id, timeout), on_frame)
+
+    def _finish_current(self, camera_config, jpg, seq, width, height):
+        camera_id = camera_config['@id']
+        camera_id_str = str(camera_id)
+
+        self.set_cookie('motion_detected_' + camera_id_str, str(motionctl.is_motion_detected(camera_id)).lower())
+        self.set_cookie('capture_fps_' + camera_id_str, '%.1f' % mjpgclient.get_fps(camera_id))
+        self.set_cookie('monitor_info_' + camera_id_str, monitor.get_monitor_info(camera_id))
+
+        if jpg is not None:
+            # the frame sequence number identifies the frame, so it serves as ETag; a client that
+            # already has the frame gets a 304, without the frame being resized or sent again
+            self.set_header('Etag', '"%s"' % seq)
+            self.set_header('Cache-Control', 'no-cache')
+            if self.check_etag_header():
+                self.set_status(304)
+                return self.try_finish(None)
+
+            jpg = mediafiles.resize_frame(camera_config, jpg, seq, width, height)
+
+        self.try_finish(jpg)
+
 
     @BaseHandler.auth()
     def list(self, camera_id):
         logging.debug('listing pictures for camera %(id)s' % {'id': camera_id})
         
         camera_config = config.get_camera(camera_id)
-        if utils.is_local_motion_camera(camera_config):
+        params = self.get_list_params()
+        if utils.is_local_motion_camera(camera_config) and self.get_argument('stream', None) == 'true':
+            self.stream_media_list(camera_config, 'picture', self.get_argument('prefix', None), params)
+
+        elif utils.is_local_motion_camera(camera_config):
             def on_media_list(media_list):
                 if media_list is None:
                     return self.finish_json({'error': 'Failed to get pictures list.'})
 
-                self.finish_json({
-                    'mediaList': media_list,
-                    'cameraName': camera_config['@name']
-                })
+                if params.get('format') == 'compact':
+                    response = dict(media_list) # may be cached, with its cursor
+
+                else:
+                    response = {'mediaList': media_list}
+                    if params.get('limit'):
+                        # a full page suggests that there are more entries
+                        full = len(media_list) >= params['limit']
+                        response['nextCursor'] = full and mediafiles.make_list_cursor(
+                                media_list[-1]['path'], media_list[-1]['timestamp']) or None
+
+                response['cameraName'] = camera_config['@name']
+
+                self.finish_json(response)
             
             mediafiles.list_media(camera_config, media_type='picture',
-                    callback=on_media_list, prefix=self.get_argument('prefix', None))
+                    callback=on_media_list, prefix=self.get_argument('prefix', None), **params)
 
         elif utils.is_remote_camera(camera_config):
             def on_response(remote_list=None, error=None):
@@ -1030,7 +1695,52 @@ class PictureHandler(BaseHandler):
 
                 self.finish_json(remote_list)
             
-            remote.list_media(camera_config, media_type='picture', prefix=self.get_argument('prefix', None), callback=on_response)
+            remote.list_media(camera_config, media_type='picture', prefix=self.get_argument('prefix', None),
+                    callback=on_response, **params)
+
+        else: # assuming simple mjpeg camera
+            raise HTTPError(400, 'unknown operation')
+
+    @BaseHandler.auth()
+    def groups(self, camera_id):
+        logging.debug('listing picture groups for camera %(id)s' % {'id': camera_id})
+
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config):
+            def on_groups(groups):
+                if groups is None:
+                    return self.finish_json({'error': 'Failed to get picture groups.'})
+
+                self.finish_json({
+                    'groups': groups,
+                    'cameraName': camera_config['@name']
+                })
+
+            mediafiles.list_groups(camera_config, media_type='picture', callback=on_groups)
+
+        elif utils.is_remote_camera(camera_config):
+            def on_list_response(remote_list=None, error=None):
+                if error:
+                    return self.finish_json({'error': 'Failed to get picture groups for %(url)s: %(msg)s.' % {
+                            'url': remote.pretty_camera_url(camera_config), 'msg': error}})
+
+                if remote_list.get('error'):
+                    return self.finish_json(remote_list)
+
+                self.finish_json({
+                    'groups': mediafiles.groups_from_media_list(remote_list['mediaList']),
+                    'cameraName': remote_list['cameraName']
+                })
+
+            def on_response(remote_groups=None, error=None):
+                if error:
+                    # older remote servers can't summarize groups; fall back to the full list
+                    return remote.list_media(camera_config, media_type='picture', prefix=None,
+                            callback=on_list_response)
+
+                self.finish_json(remote_groups)
+
+            remote.list_groups(camera_config, media_type='picture', callback=on_response)
 
         else: # assuming simple mjpeg camera
             raise HTTPError(400, 'unknown operation')
@@ -1147,12 +1857,14 @@ class PictureHandler(BaseHandler):
         
         camera_config = config.get_camera(camera_id)
         if utils.is_local_motion_camera(camera_config):
-            try:
-                mediafiles.del_media_content(camera_config, filename, 'picture')
-                self.finish_json()
-                
-            except Exception as e:
-                self.finish_json({'error': unicode(e)})
+            def on_deleted(error):
+                if error:
+                    self.finish_json({'error': error})
+
+                else:
+                    self.finish_json()
+
+            mediafiles.del_media_content(camera_config, filename, 'picture', on_deleted)
 
         elif utils.is_remote_camera(camera_config):
             def on_response(response=None, error=None):
@@ -1350,27 +2062,20 @@ class PictureHandler(BaseHandler):
         logging.debug('deleting picture group "%(group)s" of camera %(id)s' % {
                 'group': group or 'ungrouped', 'id': camera_id})
 
-        camera_config = config.get_camera(camera_id)
-        if utils.is_local_motion_camera(camera_config):
-            try:
-                mediafiles.del_media_group(camera_config, group, 'picture')
-                self.finish_json()
-                
-            except Exception as e:
-                self.finish_json({'error': unicode(e)})
+        self.delete_media_group(camera_id, group, 'picture')
 
-        elif utils.is_remote_camera(camera_config):
-            def on_response(response=None, error=None):
-                if error:
-                    return self.finish_json({'error': 'Failed to delete picture group at %(url)s: %(msg)s.' % {
-                            'url': remote.pretty_camera_url(camera_config), 'msg': error}})
+    @BaseHandler.auth(admin=True)
+    def delete_many(self, camera_id):
+        logging.debug('deleting pictures of camera %(id)s' % {'id': camera_id})
 
-                self.finish_json()
+        self.delete_media_files(camera_id, 'picture')
 
-            remote.del_media_group(camera_config, group=group, media_type='picture', callback=on_response)
+    @BaseHandler.auth(admin=True)
+    def delete_all_status(self, camera_id, group):
+        logging.debug('checking picture group deletion status for group "%(group)s" of camera %(id)s' % {
+                'group': group or 'ungrouped', 'id': camera_id})
 
-        else: # assuming simple mjpeg camera
-            raise HTTPError(400, 'unknown operation')
+        self.check_media_group_deletion(camera_id, group, 'picture')
 
     def try_finish(self, content):
         try:
@@ -1382,7 +2087,10 @@ class PictureHandler(BaseHandler):
 
 class MovieHandler(BaseHandler):
     @asynchronous
-    def get(self, camera_id, op, filename=None):
+    def get(self, camera_id, op, filename=None, group=None):
+        if group == '/': # ungrouped
+            group = ''
+
         if camera_id is not None:
             camera_id = int(camera_id)
             if camera_id not in config.get_camera_ids():
@@ -1391,12 +2099,18 @@ class MovieHandler(BaseHandler):
         if op == 'list':
             self.list(camera_id)
             
+        elif op == 'groups':
+            self.groups(camera_id)
+
         elif op == 'download':
             self.download(camera_id, filename)
         
         elif op == 'preview':
             self.preview(camera_id, filename)
         
+        elif op == 'delete_all':
+            self.delete_all_status(camera_id, group)
+
         else:
             raise HTTPError(400, 'unknown operation')
     
@@ -1416,6 +2130,9 @@ class MovieHandler(BaseHandler):
         elif op == 'delete_all':
             self.delete_all(camera_id, group)
         
+        elif op == 'delete_many':
+            self.delete_many(camera_id)
+
         else:
             raise HTTPError(400, 'unknown operation')
     
@@ -1424,18 +2141,32 @@ class MovieHandler(BaseHandler):
         logging.debug('listing movies for camera %(id)s' % {'id': camera_id})
         
         camera_config = config.get_camera(camera_id)
-        if utils.is_local_motion_camera(camera_config):
+        params = self.get_list_params()
+        if utils.is_local_motion_camera(camera_config) and self.get_argument('stream', None) == 'true':
+            self.stream_media_list(camera_config, 'movie', self.get_argument('prefix', None), params)
+
+        elif utils.is_local_motion_camera(camera_config):
             def on_media_list(media_list):
                 if media_list is None:
                     return self.finish_json({'error': 'Failed to get movies list.'})
 
-                self.finish_json({
-                    'mediaList': media_list,
-                    'cameraName': camera_config['@name']
-                })
+                if params.get('format') == 'compact':
+                    response = dict(media_list) # may be cached, with its cursor
+
+                else:
+                    response = {'mediaList': media_list}
+                    if params.get('limit'):
+                        # a full page suggests that there are more entries
+                        full = len(media_list) >= params['limit']
+                        response['nextCursor'] = full and mediafiles.make_list_cursor(
+                                media_list[-1]['path'], media_list[-1]['timestamp']) or None
+
+                response['cameraName'] = camera_config['@name']
+
+                self.finish_json(response)
             
             mediafiles.list_media(camera_config, media_type='movie',
-                    callback=on_media_list, prefix=self.get_argument('prefix', None))
+                    callback=on_media_list, prefix=self.get_argument('prefix', None), **params)
         
         elif utils.is_remote_camera(camera_config):
             def on_response(remote_list=None, error=None):
@@ -1445,7 +2176,52 @@ class MovieHandler(BaseHandler):
 
                 self.finish_json(remote_list)
             
-            remote.list_media(camera_config, media_type='movie', prefix=self.get_argument('prefix', None), callback=on_response)
+            remote.list_media(camera_config, media_type='movie', prefix=self.get_argument('prefix', None),
+                    callback=on_response, **params)
+
+        else: # assuming simple mjpeg camera
+            raise HTTPError(400, 'unknown operation')
+
+    @BaseHandler.auth()
+    def groups(self, camera_id):
+        logging.debug('listing movie groups for camera %(id)s' % {'id': camera_id})
+
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config):
+            def on_groups(groups):
+                if groups is None:
+                    return self.finish_json({'error': 'Failed to get movie groups.'})
+
+                self.finish_json({
+                    'groups': groups,
+                    'cameraName': camera_config['@name']
+                })
+
+            mediafiles.list_groups(camera_config, media_type='movie', callback=on_groups)
+
+        elif utils.is_remote_camera(camera_config):
+            def on_list_response(remote_list=None, error=None):
+                if error:
+                    return self.finish_json({'error': 'Failed to get movie groups for %(url)s: %(msg)s.' % {
+                            'url': remote.pretty_camera_url(camera_config), 'msg': error}})
+
+                if remote_list.get('error'):
+                    return self.finish_json(remote_list)
+
+                self.finish_json({
+                    'groups': mediafiles.groups_from_media_list(remote_list['mediaList']),
+                    'cameraName': remote_list['cameraName']
+                })
+
+            def on_response(remote_groups=None, error=None):
+                if error:
+                    # older remote servers can't summarize groups; fall back to the full list
+                    return remote.list_media(camera_config, media_type='movie', prefix=None,
+                            callback=on_list_response)
+
+                self.finish_json(remote_groups)
+
+            remote.list_groups(camera_config, media_type='movie', callback=on_response)
 
         else: # assuming simple mjpeg camera
             raise HTTPError(400, 'unknown operation')
@@ -1528,12 +2304,14 @@ class MovieHandler(BaseHandler):
         
         camera_config = config.get_camera(camera_id)
         if utils.is_local_motion_camera(camera_config):
-            try:
-                mediafiles.del_media_content(camera_config, filename, 'movie')
-                self.finish_json()
-                
-            except Exception as e:
-                self.finish_json({'error': unicode(e)})
+            def on_deleted(error):
+                if error:
+                    self.finish_json({'error': error})
+
+                else:
+                    self.finish_json()
+
+            mediafiles.del_media_content(camera_config, filename, 'movie', on_deleted)
 
         elif utils.is_remote_camera(camera_config):
             def on_response(response=None, error=None):
@@ -1553,27 +2331,222 @@ class MovieHandler(BaseHandler):
         logging.debug('deleting movie group "%(group)s" of camera %(id)s' % {
                 'group': group or 'ungrouped', 'id': camera_id})
 
-        camera_config = config.get_camera(camera_id)
-        if utils.is_local_motion_camera(camera_config):
+        self.delete_media_group(camera_id, group, 'movie')
+
+    @BaseHandler.auth(admin=True)
+    def delete_many(self, camera_id):
+        logging.debug('deleting movies of camera %(id)s' % {'id': camera_id})
+
+        self.delete_media_files(camera_id, 'movie')
+
+    @BaseHandler.auth(admin=True)
+    def delete_all_status(self, camera_id, group):
+        logging.debug('checking movie group deletion status for group "%(group)s" of camera %(id)s' % {
+                'group': group or 'ungrouped', 'id': camera_id})
+
+        self.check_media_group_deletion(camera_id, group, 'movie')
+
+
+class FrameSocketHandler(WebSocketHandler, BaseHandler):
+    # a single connection through which a client receives the frames and the status of several cameras;
+    # the client sends {"subscribe": {"<camera_id>": {"fps": <rate>, "width": <width>}, ...}}, replacing
+    # any previous subscription; frames are sent as binary messages made of the camera id
+    # (4 bytes, big endian) followed by the jpeg data; status changes are sent as
+    # {"status": {"<camera_id>": {"motionDetected": ..., "captureFps": ..., "monitorInfo": ...}}}
+
+    _STATUS_INTERVAL = 1 # seconds
+
+    @BaseHandler.auth(prompt=False)
+    def get(self, *args, **kwargs):
+        return WebSocketHandler.get(self, *args, **kwargs)
+
+    def open(self):
+        logging.debug('frame socket opened by %(client)s' % {'client': self.request.remote_ip})
+
+        self._subscriptions = {} # indexed by camera id
+        self._pending = {} # the frame waiting to be sent, indexed by camera id
+        self._last_camera_id = None
+        self._writing = False
+        self._next_timeout = None
+        self._status = {}
+
+        self._status_timer = PeriodicCallback(self._send_status, self._STATUS_INTERVAL * 1000)
+        self._status_timer.start()
+
+    def on_message(self, message):
+        try:
+            message = json.loads(message)
+            subscriptions = dict((int(k), v) for (k, v) in message['subscribe'].iteritems())
+
+        except Exception as e:
+            logging.error('invalid frame socket message from %(client)s: %(msg)s' % {
+                    'client': self.request.remote_ip, 'msg': unicode(e)})
+
+            return self._write({'error': 'invalid message'})
+
+        # the fps and the width are either positive numbers or null (0 also stands for no fps limit);
+        # an invalid subscription is reported and ignored, leaving the previous one (if any) in place
+        errors = {}
+        for camera_id, subscription in subscriptions.items():
             try:
-                mediafiles.del_media_group(camera_config, group, 'movie')
-                self.finish_json()
-                
-            except Exception as e:
-                self.finish_json({'error': unicode(e)})
+                fps = float(subscription.get('fps') or 0)
+                width = subscription.get('width')
+                if width is not None:
+                    width = float(width)
+                    if not 0 < width < float('inf'):
+                        raise ValueError('invalid width: %s' % width)
+
+                if not 0 <= fps < float('inf'):
+                    raise ValueError('invalid fps: %s' % fps)
+
+            except (AttributeError, TypeError, ValueError) as e:
+                logging.error('invalid frame socket subscription to camera %(id)s from %(client)s: %(msg)s' % {
+                        'id': camera_id, 'client': self.request.remote_ip, 'msg': unicode(e)})
+
+                errors[camera_id] = {'error': 'invalid subscription'}
+                del subscriptions[camera_id]
+                continue
 
-        elif utils.is_remote_camera(camera_config):
-            def on_response(response=None, error=None):
-                if error:
-                    return self.finish_json({'error': 'Failed to delete movie group at %(url)s: %(msg)s.' % {
-                            'url': remote.pretty_camera_url(camera_config), 'msg': error}})
+            subscriptions[camera_id] = {'fps': fps, 'width': width}
 
-                self.finish_json()
+        for camera_id, subscription in self._subscriptions.items():
+            if camera_id not in subscriptions and camera_id not in errors:
+                mjpgclient.unsubscribe(camera_id, subscription['callback'])
+                del self._subscriptions[camera_id]
+                self._pending.pop(camera_id, None)
+                self._status.pop(camera_id, None)
 
-            remote.del_media_group(camera_config, group=group, media_type='movie', callback=on_response)
+        for camera_id, subscription in subscriptions.iteritems():
+            if camera_id in self._subscriptions:
+                self._subscriptions[camera_id].update(subscription)
+                continue
 
-        else: # assuming simple mjpeg camera
-            raise HTTPError(400, 'unknown operation')
+            camera_config = config.get_camera(camera_id) if camera_id in config.get_camera_ids() else None
+            if not camera_config or not utils.is_local_motion_camera(camera_config):
+                errors[camera_id] = {'error': 'camera can\'t be streamed'}
+                continue
+
+            subscription['callback'] = functools.partial(self._on_jpg, camera_id)
+            subscription['camera_config'] = camera_config
+            subscription['next_time'] = 0
+            if not mjpgclient.subscribe(camera_id, subscription['callback']):
+                errors[camera_id] = {'error': 'camera can\'t be streamed'}
+                continue
+
+            self._subscriptions[camera_id] = subscription
+            last_jpg, last_seq = mjpgclient.get_frame(camera_id)
+            if last_jpg:
+                self._on_jpg(camera_id, last_jpg, last_seq)
+
+        if errors:
+            self._write({'status': errors})
+
+        self._send_status()
+
+    def on_close(self):
+        logging.debug('frame socket closed by %(client)s' % {'client': self.request.remote_ip})
+
+        self._status_timer.stop()
+        if self._next_timeout:
+            IOLoop.instance().remove_timeout(self._next_timeout)
+            self._next_timeout = None
+
+        for camera_id, subscription in self._subscriptions.iteritems():
+            mjpgclient.unsubscribe(camera_id, subscription['callback'])
+
+        self._subscriptions = {}
+        self._pending = {}
+
+    def _on_jpg(self, camera_id, jpg, seq):
+        if camera_id not in self._subscriptions:
+            return
+
+        self._pending[camera_id] = (jpg, seq) # replaces the previous one, if still not sent
+        self._send_next()
+
+    def _send_next(self):
+        # sends one pending frame at a time, taking the cameras in turns,
+        # so that a busy camera doesn't delay the others on a slow connection;
+        # a frame that is not due yet, according to the requested rate or to the rate allowed for this viewer,
+        # is kept and sent when its slot comes up
+        if self._writing or not self._pending:
+            return
+
+        now = time.time()
+        delays = dict((c, max(self._subscriptions[c]['next_time'] - now, self.get_frame_delay(c)))
+                for c in self._pending)
+
+        camera_ids = sorted(c for (c, d) in delays.iteritems() if d <= 0)
+        if not camera_ids:
+            self._schedule_next(min(delays.itervalues()))
+            return
+
+        after = [c for c in camera_ids if c > self._last_camera_id]
+        camera_id = (after or camera_ids)[0]
+        jpg, seq = self._pending.pop(camera_id)
+        subscription = self._subscriptions[camera_id]
+
+        if subscription['fps'] > 0: # the next slot follows the previous one, so frames coming at the same rate fit
+            subscription['next_time'] = max(subscription['next_time'], now - 1.0 / subscription['fps'])
+            subscription['next_time'] += 1.0 / subscription['fps']
+
+        self.reserve_frame(camera_id, subscription['camera_config'].get('stream_maxrate'))
+
+        if subscription['width']:
+            jpg = mediafiles.resize_frame(subscription['camera_config'], jpg, seq, subscription['width'], None)
+
+        self._last_camera_id = camera_id
+        self._writing = True
+        future = self._write(struct.pack('>I', camera_id) + jpg, binary=True)
+        if future:
+            IOLoop.instance().add_future(future, self._on_written)
+
+        else: # tornado < 4.3 doesn't return a future, so wait for the stream to be drained instead
+            try:
+                self.ws_connection.stream.write('', functools.partial(self._on_written, None))
+
+            except Exception: # closed
+                self._writing = False
+
+    def _schedule_next(self, delay):
+        io_loop = IOLoop.instance()
+        if self._next_timeout:
+            io_loop.remove_timeout(self._next_timeout)
+
+        self._next_timeout = io_loop.add_timeout(datetime.timedelta(seconds=delay), self._on_next_timeout)
+
+    def _on_next_timeout(self):
+        self._next_timeout = None
+        self._send_next()
+
+    def _on_written(self, future):
+        self._writing = False
+        self._send_next()
+
+    def _send_status(self):
+        changes = {}
+        for camera_id in self._subscriptions:
+            status = {
+                'motionDetected': motionctl.is_motion_detected(camera_id),
+                'captureFps': round(mjpgclient.get_fps(camera_id), 1),
+                'monitorInfo': monitor.get_monitor_info(camera_id)
+            }
+
+            old_status = self._status.get(camera_id, {})
+            delta = dict((k, v) for (k, v) in status.iteritems() if old_status.get(k) != v)
+            if delta:
+                changes[camera_id] = delta
+                self._status[camera_id] = status
+
+        if changes:
+            self._write({'status': changes})
+
+    def _write(self, message, binary=False):
+        try:
+            return self.write_message(message, binary=binary)
+
+        except WebSocketClosedError:
+            return None
 
 
 class ActionHandler(BaseHandler):
@@ -1703,6 +2676,9 @@ class RelayEventHandler(BaseHandler):
         elif event == 'movie_end':
             filename = self.get_argument('filename')
             
+            # update the media index right away
+            mediawatch.notify(camera_config, filename)
+
             # generate preview (thumbnail)
             tasks.add(5, mediafiles.make_movie_preview, tag='make_movie_preview(%s)' % filename,
                     camera_config=camera_config, full_path=filename)
@@ -1714,6 +2690,9 @@ class RelayEventHandler(BaseHandler):
         elif event == 'picture_save':
             filename = self.get_argument('filename')
             
+            # update the media index right away
+            mediawatch.notify(camera_config, filename)
+
             # upload to external service
             if camera_config['@upload_enabled'] and camera_config['@upload_picture']:
                 self.upload_media_file(filename, camera_id, camera_config)
@@ -15,20 +15,22 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>. 
 
+import base64
+import calendar
 import datetime
 import errno
 import fcntl
 import functools
 import hashlib
+import heapq
 import logging
-import multiprocessing
+import math
 import os.path
 import pipes
 import re
-import signal
-import stat
 import StringIO
 import subprocess
+import thread
 import time
 import zipfile
 
@@ -36,8 +38,11 @@ from PIL import Image
 from tornado.ioloop import IOLoop
 
 import config
+import mediaindex
+import mediawatch
 import settings
 import utils
+import workers
 
 
 _PICTURE_EXTS = ['.jpg']
@@ -76,114 +81,389 @@ FFMPEG_EXT_MAPPING = {
     'hevc': 'mp4'
 }
 
+_MEGABYTE = 1024 * 1024
+
+# the number of media files fetched at once from the index when enforcing quotas
+_QUOTA_BATCH_SIZE = 100
+
+# the number of entries passed at once to the chunk callback of a listing
+_LIST_CHUNK_SIZE = 100
+
+# listing results are reused for this number of seconds,
+# as long as the mtime of the listed directory doesn't change
+_LIST_CACHE_TTL = 5
+_LIST_CACHE_MAX_ENTRIES = 32
+
+# recent listing results, as (time, directory mtime, media list), indexed by listing key
+_list_cache = {}
+
+# callbacks waiting for an in-flight listing, indexed by listing key
+_list_waiters = {}
+
+# the ids of the cameras whose media index is being initialized by a worker
+_index_inits = set()
+
 # a cache of prepared files (whose preparing time is significant)
 _prepared_files = {}
 
+# background media group deletion jobs, indexed by job id
+_deletion_jobs = {}
+
+# how long (in seconds) a finished deletion job is remembered, so that its outcome can be checked
+_DELETION_JOB_TTL = 300
+
+# the resized versions of the last frame of each camera, indexed by camera id
+_resized_frames = {}
+
+# the maximum number of sizes kept for a frame
+_RESIZED_FRAME_CACHE_SIZE = 8
+
+# the last mosaic composed for each set of cameras and size, along with the frames it was composed of
+_mosaics = {}
+
+# the maximum number of mosaics kept
+_MOSAIC_CACHE_SIZE = 8
+
+# the resampling filters used for resizing pictures, by settings.RESIZE_QUALITY;
+# 'normal' keeps the default filter of each caller
+_RESAMPLE_FILTERS = {
+    'fast': Image.NEAREST,
+    'normal': None,
+    'best': Image.ANTIALIAS
+}
+
+# used to limit the rate of removals during cleanup
+_removal_lock = thread.allocate_lock()
+_next_removal_time = 0
+
 _timelapse_process = None
 _timelapse_data = None
 
 
-def findfiles(path):
-    files = []
-    for name in os.listdir(path):
-        # ignore hidden files/dirs and other unwanted files
-        if name.startswith('.') or name == 'lastsnap.jpg':
+def _flush_media_watch(camera_config):
+    # the index of a watched camera is kept up to date by file system events;
+    # the events that are still pending are handed over to the workers here, on the IO loop,
+    # before submitting a worker job that queries the index (and applies them first)
+    if mediawatch.is_current(camera_config['@id']):
+        mediawatch.flush(camera_config['@id'])
+
+
+def _sync_media_index(camera_config, group=None):
+    mediawatch.apply_changes(camera_config['@id'])
+    if not mediawatch.is_current(camera_config['@id']):
+        # bring the media index up to date with the file system
+        # (only directories that have changed since the last sync are scanned)
+        mediaindex.sync(camera_config, group=group)
+
+
+def _list_media_files(camera_config, media_type, prefix=None, since=None, until=None,
+        after=None, limit=None, reverse=False):
+
+    if prefix == 'ungrouped':
+        prefix = ''
+
+    _sync_media_index(camera_config, group=prefix)
+
+    return mediaindex.find(camera_config, media_type, group=prefix, since=since, until=until,
+            after=after, limit=limit, reverse=reverse)
+
+
+def _remove_media_file(full_path):
+    # returns False if the file is still there
+    try:
+        os.remove(full_path)
+
+    except OSError as e:
+        if e.errno != errno.ENOENT: # otherwise, the file might have been removed in the meantime
+            logging.error('failed to remove %s: %s' % (full_path, e))
+
+            return False
+
+    # remove the thumb file, if any
+    try:
+        os.remove(full_path + '.thumb')
+
+    except OSError:
+        pass
+
+    return True
+
+
+def _remove_older_files(camera_config, moment, media_type):
+    target_dir = camera_config['target_dir']
+    timestamp = time.mktime(moment.timetuple())
+
+    started = time.time()
+    mediaindex.sync(camera_config)
+
+    # first remove the directories that only contain expired files (e.g. the days past the cutoff),
+    # without looking at the files one by one
+    dir_paths = set()
+    removed_dirs = 0
+    for (rel_dir, count) in mediaindex.find_expired_dirs(camera_config, media_type, timestamp):
+        full_dir = os.path.join(target_dir, rel_dir)
+        if _remove_expired_dir(full_dir, count):
+            mediaindex.remove_dir(camera_config, rel_dir)
+            dir_paths.add(os.path.dirname(full_dir))
+            removed_dirs += 1
+
+    # then the expired files of the remaining directories, at the boundary of the cutoff
+    mf = mediaindex.find(camera_config, media_type, until=timestamp)
+    removed = []
+    for (path, mtime, size) in mf:  # @UnusedVariable
+        full_path = os.path.join(target_dir, path[1:])
+        logging.debug('removing file %(path)s...' % {'path': full_path})
+
+        _throttle_removal()
+        if _remove_media_file(full_path):
+            removed.append(path)
+            dir_paths.add(os.path.dirname(full_path))
+
+    # the files that could not be removed stay in the index, to be retried by the next cleanup
+    mediaindex.remove(camera_config, removed)
+
+    if media_type == 'movie':
+        # the thumbs are not indexed, so the directories left with nothing but
+        # the thumbs of movies removed by other means are cleaned up here
+        for rel_dir in mediaindex.find_empty_dirs(camera_config, timestamp):
+            dir_paths.add(os.path.join(target_dir, rel_dir))
+
+    _remove_empty_dirs(target_dir, dir_paths)
+
+    logging.info('removed %(dirs)s %(media_type)s directories and %(files)s %(media_type)ss of camera %(id)s '
+            'in %(time).3fs' % {'dirs': removed_dirs, 'files': len(removed), 'media_type': media_type,
+            'id': camera_config['@id'], 'time': time.time() - started})
+
+
+def _remove_expired_dir(full_dir, count):
+    # removes a directory as a whole, provided that it contains exactly the count media files
+    # known to the index (and their thumbs); returns False if it has to be cleaned up file by file
+    try:
+        names = os.listdir(full_dir)
+
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return True # removed in the meantime
+
+        logging.error('failed to list directory %(path)s: %(msg)s' % {'path': full_dir, 'msg': unicode(e)})
+
+        return False
+
+    media_names = [n for n in names if not n.endswith('.thumb')]
+    if len(media_names) != count or [n for n in media_names if n.startswith('.') or n == 'lastsnap.jpg']:
+        return False # something unknown to the index lives here
+
+    logging.debug('removing directory %(path)s...' % {'path': full_dir})
+
+    # the listing above is enough to remove the files, without walking the directory again
+    try:
+        for name in names:
+            if not name.endswith('.thumb'):
+                _throttle_removal()
+
+            os.remove(os.path.join(full_dir, name))
+
+        os.rmdir(full_dir)
+
+    except OSError as e:
+        logging.error('failed to remove %(path)s: %(msg)s' % {'path': full_dir, 'msg': unicode(e)})
+
+        return False
+
+    return True
+
+
+def _throttle_removal():
+    # limits the rate at which the janitor removes media files to settings.CLEANUP_RATE_LIMIT per second,
+    # across all the threads of the cleanup process, by handing out removal slots
+    global _next_removal_time
+
+    if not settings.CLEANUP_RATE_LIMIT:
+        return
+
+    with _removal_lock:
+        now = time.time()
+        slot = max(now, _next_removal_time)
+        _next_removal_time = slot + 1.0 / settings.CLEANUP_RATE_LIMIT
+
+    if slot > now:
+        time.sleep(slot - now)
+
+
+def _remove_empty_dirs(target_dir, dir_paths):
+    # remove the orphan thumb files of the given directories,
+    # as well as the directories themselves if empty or contain only thumb files
+    for dir_path in sorted(dir_paths, reverse=True):
+        if not os.path.exists(dir_path):
             continue
-        pathname = os.path.join(path, name)
-        st = os.lstat(pathname)
-        mode = st.st_mode
-        if stat.S_ISDIR(mode):
-            files.extend(findfiles(pathname))
 
-        elif stat.S_ISREG(mode):
-            files.append((pathname, name, st))
+        listing = os.listdir(dir_path)
+        names = set(listing)
+        thumbs = [l for l in listing if l.endswith('.thumb')]
+        orphan_thumbs = [l for l in thumbs if l[:-6] not in names]
 
-    return files
+        for p in orphan_thumbs:
+            try:
+                os.remove(os.path.join(dir_path, p))
 
+            except Exception as e:
+                logging.error('failed to remove %s: %s' % (p, e))
 
-def _list_media_files(dir, exts, prefix=None):
-    media_files = []
-    
-    if prefix is not None:
-        if prefix == 'ungrouped':
-            prefix = ''
-        
-        root = os.path.join(dir, prefix)
-        for name in os.listdir(root):
-            # ignore hidden files/dirs and other unwanted files
-            if name.startswith('.') or name == 'lastsnap.jpg':
-                continue
-                
-            full_path = os.path.join(root, name)
+        if len(listing) == len(thumbs) and dir_path != target_dir: # only thumbs
+            logging.debug('removing empty directory %(path)s...' % {'path': dir_path})
             try:
-                st = os.stat(full_path)
-            
+                os.removedirs(dir_path)
+
             except Exception as e:
-                logging.error('stat failed: ' + unicode(e))
-                continue
-                
-            if not stat.S_ISREG(st.st_mode): # not a regular file
-                continue
+                logging.error('failed to remove %s: %s' % (dir_path, e))
 
-            full_path_lower = full_path.lower()
-            if not [e for e in exts if full_path_lower.endswith(e)]:
-                continue
-            
-            media_files.append((full_path, st))
 
-    else:
-        for full_path, name, st in findfiles(dir):
-            full_path_lower = full_path.lower()
-            if not [e for e in exts if full_path_lower.endswith(e)]:
-                continue
+def _iter_oldest_files(camera_config):
+    # yields (timestamp, camera id, path, size) for the pictures and movies of a camera, oldest first
+    after = None
+    while True:
+        mf = mediaindex.find(camera_config, ['picture', 'movie'], after=after, limit=_QUOTA_BATCH_SIZE)
+        for (path, timestamp, size) in mf:
+            yield (timestamp, camera_config['@id'], path, size)
 
-            media_files.append((full_path, st))
+        if len(mf) < _QUOTA_BATCH_SIZE:
+            break
 
-    return media_files
+        (path, timestamp, size) = mf[-1]
+        after = (timestamp, path)
 
 
-def _remove_older_files(dir, moment, exts):
-    for (full_path, st) in _list_media_files(dir, exts):
-        file_moment = datetime.datetime.fromtimestamp(st.st_mtime)
-        if file_moment < moment:
-            logging.debug('removing file %(path)s...' % {'path': full_path})
-            
-            # remove the file itself
-            try:
-                os.remove(full_path)
-            
-            except OSError as e:
-                if e.errno == errno.ENOENT:
-                    pass # the file might have been removed in the meantime
-                
-                else:
-                    logging.error('failed to remove %s: %s' % (full_path, e))
+def _remove_oldest_files(camera_configs, size):
+    # removes the oldest pictures and movies of the given cameras,
+    # until at least size bytes have been freed; returns the number of bytes freed per camera
+    camera_configs = dict((c['@id'], c) for c in camera_configs)
+    merged = heapq.merge(*[_iter_oldest_files(c) for c in camera_configs.itervalues()])
 
-            # remove the parent directories if empty or contain only thumb files
-            dir_path = os.path.dirname(full_path)
-            if not os.path.exists(dir_path):
-                continue
-            
-            listing = os.listdir(dir_path)
-            thumbs = [l for l in listing if l.endswith('.thumb')]
-            
-            if len(listing) == len(thumbs): # only thumbs
-                for p in thumbs:
-                    try:
-                        os.remove(os.path.join(dir_path, p))
-                    
-                    except:
-                        logging.error('failed to remove %s: %s' % (p, e))
+    freed = {}
+    removed_paths = {}
+    dir_paths = {}
+    for (timestamp, camera_id, path, file_size) in merged:  # @UnusedVariable
+        if sum(freed.values()) >= size:
+            break
 
-            if not listing or len(listing) == len(thumbs):
-                # this will possibly cause following paths that are in the media files for loop
-                # to be removed in advance; the os.remove call will raise ENOENT which is silently ignored 
-                logging.debug('removing empty directory %(path)s...' % {'path': dir_path})
-                try:
-                    os.removedirs(dir_path)
-                
-                except:
-                    logging.error('failed to remove %s: %s' % (dir_path, e))
+        target_dir = camera_configs[camera_id]['target_dir']
+        full_path = os.path.join(target_dir, path[1:])
+        logging.debug('removing file %(path)s to free up space...' % {'path': full_path})
+
+        _throttle_removal()
+        if not _remove_media_file(full_path):
+            continue # nothing freed, and left in the index
+
+        freed[camera_id] = freed.get(camera_id, 0) + file_size
+        removed_paths.setdefault(camera_id, []).append(path)
+        dir_paths.setdefault(camera_id, set()).add(os.path.dirname(full_path))
+
+    for (camera_id, paths) in removed_paths.iteritems():
+        camera_config = camera_configs[camera_id]
+        mediaindex.remove(camera_config, paths)
+        _remove_empty_dirs(camera_config['target_dir'], dir_paths[camera_id])
+
+    return freed
+
+
+def _get_free_space(path):
+    try:
+        st = os.statvfs(path)
+
+    except OSError:
+        return None
+
+    return st.f_bavail * st.f_frsize
+
+
+def _get_quota_cameras():
+    camera_configs = []
+    for camera_id in config.get_camera_ids():
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config) and os.path.exists(camera_config['target_dir']):
+            camera_configs.append(camera_config)
+
+    return camera_configs
+
+
+def _get_media_size(camera_config, usage=None):
+    usage = usage or _make_usage(mediaindex.get_usage(camera_config))
+
+    return usage.get('picture', {}).get('size', 0) + usage.get('movie', {}).get('size', 0)
+
+
+def needs_quota_cleanup():
+    # tells whether a size quota is exceeded or the free space is too low, judging by
+    # what the media index currently knows; meant to be run in a worker thread
+    camera_configs = _get_quota_cameras()
+    if not settings.MAX_MEDIA_SIZE and not settings.MIN_FREE_SPACE and \
+            not any(c.get('@max_media_size') for c in camera_configs):
+
+        return False
+
+    total = 0
+    for camera_config in camera_configs:
+        usage = get_cached_media_usage(camera_config, init_index=True)
+        if usage is None:
+            continue
+
+        size = _get_media_size(camera_config, usage)
+        max_size = camera_config.get('@max_media_size', 0) * _MEGABYTE
+        if max_size and size > max_size:
+            return True
+
+        free = _get_free_space(camera_config['target_dir'])
+        if settings.MIN_FREE_SPACE and free is not None and free < settings.MIN_FREE_SPACE * _MEGABYTE:
+            return True
+
+        total += size
+
+    return bool(settings.MAX_MEDIA_SIZE and total > settings.MAX_MEDIA_SIZE * _MEGABYTE)
+
+
+def cleanup_media_quota():
+    # removes the oldest media files of the cameras that exceed their size quota,
+    # then of all cameras if the global quota is exceeded,
+    # then of the cameras whose disk is running out of free space
+    logging.debug('cleaning up media files exceeding quotas...')
+
+    camera_configs = _get_quota_cameras()
+    sizes = {}
+    for camera_config in camera_configs:
+        mediaindex.sync(camera_config)
+        sizes[camera_config['@id']] = _get_media_size(camera_config)
+
+    def remove(camera_configs, size, reason):
+        logging.info('removing %(size)s of old media files of camera(s) %(ids)s: %(reason)s' % {
+                'size': utils.pretty_size(size), 'ids': ', '.join([str(c['@id']) for c in camera_configs]),
+                'reason': reason})
+
+        freed = _remove_oldest_files(camera_configs, size)
+        for (camera_id, s) in freed.iteritems():
+            sizes[camera_id] -= s
+
+    for camera_config in camera_configs:
+        max_size = camera_config.get('@max_media_size', 0) * _MEGABYTE
+        size = sizes[camera_config['@id']]
+        if max_size and size > max_size:
+            remove([camera_config], size - max_size, 'camera quota exceeded')
+
+    max_size = settings.MAX_MEDIA_SIZE * _MEGABYTE
+    size = sum(sizes.values())
+    if max_size and size > max_size:
+        remove(camera_configs, size - max_size, 'global quota exceeded')
+
+    if settings.MIN_FREE_SPACE:
+        # cameras sharing a disk free up space together
+        devices = {}
+        for camera_config in camera_configs:
+            devices.setdefault(os.stat(camera_config['target_dir']).st_dev, []).append(camera_config)
+
+        for device_camera_configs in devices.itervalues():
+            free = _get_free_space(device_camera_configs[0]['target_dir'])
+            min_free = settings.MIN_FREE_SPACE * _MEGABYTE
+            if free is not None and free < min_free:
+                remove(device_camera_configs, min_free - free, 'low free space')
 
 
 def find_ffmpeg():
@@ -197,41 +477,39 @@ def find_ffmpeg():
 def cleanup_media(media_type):
     logging.debug('cleaning up %(media_type)ss...' % {'media_type': media_type})
     
-    if media_type == 'picture':
-        exts = _PICTURE_EXTS
-        
-    elif media_type == 'movie':
-        exts = _MOVIE_EXTS + ['.thumb']
-        
     for camera_id in config.get_camera_ids():
         camera_config = config.get_camera(camera_id)
         if not utils.is_local_motion_camera(camera_config):
             continue
-        
-        preserve_media = camera_config.get('@preserve_%(media_type)ss' % {'media_type': media_type}, 0)
-        if preserve_media == 0:
-            continue # preserve forever
-        
-        still_images_enabled = bool(
-                ((camera_config['emulate_motion'] or camera_config['output_pictures']) and camera_config['picture_filename']) or
-                (camera_config['snapshot_interval'] and camera_config['snapshot_filename']))
-        
-        movies_enabled = camera_config['ffmpeg_output_movies']
 
-        if media_type == 'picture' and not still_images_enabled:
-            continue # only cleanup pictures for cameras with still images enabled
-        
-        elif media_type == 'movie' and not movies_enabled:
-            continue # only cleanup movies for cameras with movies enabled
+        cleanup_camera_media(camera_config, media_type)
+
+
+def cleanup_camera_media(camera_config, media_type):
+    preserve_media = camera_config.get('@preserve_%(media_type)ss' % {'media_type': media_type}, 0)
+    if preserve_media == 0:
+        return # preserve forever
+
+    still_images_enabled = bool(
+            ((camera_config['emulate_motion'] or camera_config['output_pictures']) and camera_config['picture_filename']) or
+            (camera_config['snapshot_interval'] and camera_config['snapshot_filename']))
 
-        preserve_moment = datetime.datetime.now() - datetime.timedelta(days=preserve_media)
+    movies_enabled = camera_config['ffmpeg_output_movies']
 
-        target_dir = camera_config.get('target_dir')
-        if os.path.exists(target_dir):
-            # create a sentinel file to make sure the target dir is never removed
-            open(os.path.join(target_dir, '.keep'), 'w').close()
+    if media_type == 'picture' and not still_images_enabled:
+        return # only cleanup pictures for cameras with still images enabled
 
-        _remove_older_files(target_dir, preserve_moment, exts=exts)
+    elif media_type == 'movie' and not movies_enabled:
+        return # only cleanup movies for cameras with movies enabled
+
+    preserve_moment = datetime.datetime.now() - datetime.timedelta(days=preserve_media)
+
+    target_dir = camera_config.get('target_dir')
+    if os.path.exists(target_dir):
+        # create a sentinel file to make sure the target dir is never removed
+        open(os.path.join(target_dir, '.keep'), 'w').close()
+
+    _remove_older_files(camera_config, preserve_moment, media_type)
 
 
 def make_movie_preview(camera_config, full_path):
@@ -299,78 +577,364 @@ def make_movie_preview(camera_config, full_path):
         
         return None
 
+    mediaindex.update(camera_config, [thumb_path])
+
     return thumb_path
 
 
-def list_media(camera_config, media_type, callback, prefix=None):
-    target_dir = camera_config.get('target_dir')
+def make_list_cursor(path, timestamp):
+    # an opaque token pointing after the given media list entry,
+    # used to request the next page of a paginated media list
+    return base64.urlsafe_b64encode('%r:%s' % (timestamp, path))
 
-    if media_type == 'picture':
-        exts = _PICTURE_EXTS
-        
-    elif media_type == 'movie':
-        exts = _MOVIE_EXTS
-
-    # create a subprocess to retrieve media files
-    def do_list_media(pipe):
-        mf = _list_media_files(target_dir, exts=exts, prefix=prefix)
-        for (p, st) in mf:
-            path = p[len(target_dir):]
-            if not path.startswith('/'):
-                path = '/' + path
-    
-            timestamp = st.st_mtime
-            size = st.st_size
-            
-            pipe.send({
+
+def parse_list_cursor(cursor):
+    try:
+        (timestamp, path) = base64.urlsafe_b64decode(str(cursor)).split(':', 1)
+
+        return (float(timestamp), path)
+
+    except (TypeError, ValueError):
+        raise ValueError('invalid cursor: %s' % cursor)
+
+
+def list_media(camera_config, media_type, callback, prefix=None, since=None, until=None,
+        limit=None, cursor=None, order=None, format=None, chunk_callback=None):
+
+    # when chunk_callback is given, it is called with the entries as they are produced
+    # and the final callback only receives an empty list (or None in case of an error);
+    # with the compact format (which can't be chunked), the callback receives the structure
+    # made by make_compact_list() instead of a list; it may be cached, so it must not be changed
+
+    after = cursor and parse_list_cursor(cursor)
+    reverse = order == 'desc'
+
+    def do_list_media(send):
+        mf = _list_media_files(camera_config, media_type, prefix=prefix, since=since, until=until,
+                after=after, limit=limit, reverse=reverse)
+        if format == 'compact':
+            # built here rather than on the IO loop, and cached as such along with the listing
+            compact = make_compact_list(mf)
+            if limit:
+                # a full page suggests that there are more entries
+                full = len(mf) >= limit
+                compact['nextCursor'] = full and make_list_cursor(mf[-1][0], mf[-1][1]) or None
+
+            send(compact)
+
+            return
+
+        for (path, timestamp, size) in mf:
+            send({
                 'path': path,
                 'momentStr': utils.pretty_date_time(datetime.datetime.fromtimestamp(timestamp)),
                 'momentStrShort': utils.pretty_date_time(datetime.datetime.fromtimestamp(timestamp), short=True),
                 'sizeStr': utils.pretty_size(size),
                 'timestamp': timestamp
             })
-        
-        pipe.close()
-    
-    logging.debug('starting media listing process...')
-    
-    (parent_pipe, child_pipe) = multiprocessing.Pipe(duplex=False)
-    process = multiprocessing.Process(target=do_list_media, args=(child_pipe, ))
-    process.start()
-    
-    # poll the subprocess to see when it has finished
-    started = datetime.datetime.now()
-    media_list = []
-    
-    def read_media_list():
-        while parent_pipe.poll():
-            media_list.append(parent_pipe.recv())
-    
-    def poll_process():
-        io_loop = IOLoop.instance()
-        if process.is_alive(): # not finished yet
-            now = datetime.datetime.now()
-            delta = now - started
-            if delta.seconds < settings.LIST_MEDIA_TIMEOUT:
-                io_loop.add_timeout(datetime.timedelta(seconds=0.5), poll_process)
-                read_media_list()
-            
-            else: # process did not finish in time
-                logging.error('timeout waiting for the media listing process to finish')
-                try:
-                    os.kill(process.pid, signal.SIGTERM)
-                
-                except:
-                    pass # nevermind
-                    
-                callback(None)
 
-        else: # finished
-            read_media_list()
-            logging.debug('media listing process has returned %(count)s files' % {'count': len(media_list)})
+    key = ('media', camera_config['@id'], media_type, prefix, since, until, limit, cursor, order, format)
+    list_dir = camera_config['target_dir']
+    if prefix and prefix != 'ungrouped':
+        list_dir = os.path.join(list_dir, prefix)
+
+    if format == 'compact':
+        def on_compact_list(media_list):
+            callback(media_list and media_list[0])
+
+        _flush_media_watch(camera_config)
+        _run_shared_listing(key, list_dir, do_list_media, on_compact_list, 'media')
+
+        return
+
+    _flush_media_watch(camera_config)
+    _run_shared_listing(key, list_dir, do_list_media, callback, 'media', chunk_callback=chunk_callback)
+
+
+def make_compact_list(media_list):
+    # turns a list of (path, timestamp, size) tuples into a columnar structure,
+    # where each file is designated by its group index and its name within the group;
+    # formatting the dates and sizes is left to the client
+    groups = []
+    group_indexes = {}
+    compact = {
+        'format': 'compact',
+        'groups': groups,
+        'groupIndexes': [],
+        'names': [],
+        'timestamps': [],
+        'sizes': []
+    }
+
+    utc_offsets = []
+    offsets_by_quarter = {} # UTC offsets only change at a quarter of an hour
+    for (path, timestamp, size) in media_list:
+        (group, name) = path.rsplit('/', 1)
+        group = group[1:]
+        index = group_indexes.get(group)
+        if index is None:
+            index = group_indexes[group] = len(groups)
+            groups.append(group)
+
+        timestamp = int(timestamp)
+
+        compact['groupIndexes'].append(index)
+        compact['names'].append(name)
+        compact['timestamps'].append(timestamp)
+        compact['sizes'].append(size)
+
+        # dates are shown in the local time of the server
+        quarter = timestamp // 900
+        utc_offset = offsets_by_quarter.get(quarter)
+        if utc_offset is None:
+            utc_offset = offsets_by_quarter[quarter] = calendar.timegm(time.localtime(timestamp)) - timestamp
+
+        utc_offsets.append(utc_offset)
+
+    # the offset is the same for all files, unless they span a DST change
+    if len(set(utc_offsets)) > 1:
+        compact['utcOffset'] = utc_offsets
+
+    else:
+        compact['utcOffset'] = utc_offsets[0] if utc_offsets else 0
+
+    return compact
+
+
+def list_groups(camera_config, media_type, callback):
+    def do_list_groups(send):
+        _sync_media_index(camera_config)
+        for (group, count, size, first, last) in mediaindex.find_groups(camera_config, media_type):
+            send({
+                'key': group,
+                'count': count,
+                'size': size,
+                'sizeStr': utils.pretty_size(size),
+                'firstTimestamp': first,
+                'lastTimestamp': last
+            })
+
+    key = ('groups', camera_config['@id'], media_type)
+
+    _flush_media_watch(camera_config)
+    _run_shared_listing(key, camera_config['target_dir'], do_list_groups, callback, 'groups')
+
+
+def get_media_usage(camera_config, callback):
+    # brings the media index up to date and calls back with the storage used by the camera,
+    # in total and for each group
+    def do_get_usage():
+        _sync_media_index(camera_config)
+
+        return _make_usage(mediaindex.get_usage(camera_config), groups=True)
+
+    def on_usage(future):
+        try:
+            callback(future.result())
+
+        except workers.TimeoutError:
+            logging.error('timeout waiting for the media usage of camera %(id)s' % {'id': camera_config['@id']})
+            callback(None)
+
+        except Exception:
+            callback(None) # already logged by the worker
+
+    _flush_media_watch(camera_config)
+    future = workers.submit(do_get_usage, settings.LIST_MEDIA_TIMEOUT)
+    IOLoop.instance().add_future(future, on_usage)
+
+
+def get_cached_media_usage(camera_config, init_index=False):
+    # the storage used by the camera, as currently known by the media index; unless init_index is True,
+    # an index that is not ready yet (e.g. after changing the target dir) is initialized in a worker thread
+    # and None is returned in the meantime, so that this can be called on the IO loop
+    if not init_index and not mediaindex.is_ready(camera_config):
+        _init_media_index(camera_config)
+
+        return None
+
+    try:
+        return _make_usage(mediaindex.get_usage(camera_config))
+
+    except Exception as e:
+        logging.error('failed to get media usage of camera %(id)s: %(msg)s' % {
+                'id': camera_config['@id'], 'msg': unicode(e)})
+
+        return None
+
+
+def _init_media_index(camera_config):
+    camera_id = camera_config['@id']
+    if camera_id in _index_inits:
+        return # already in progress
+
+    def on_init(future):
+        _index_inits.discard(camera_id)
+        try:
+            future.result()
+
+        except workers.TimeoutError:
+            logging.error('timeout waiting for the media index of camera %(id)s to be initialized' % {
+                    'id': camera_id})
+
+        except Exception:
+            pass # already logged by the worker
+
+    _index_inits.add(camera_id)
+    future = workers.submit(mediaindex.init, settings.LIST_MEDIA_TIMEOUT, camera_config)
+    IOLoop.instance().add_future(future, on_init)
+
+
+def _make_usage(rows, groups=False):
+    usage = {'total': {'count': 0, 'size': 0}}
+    group_usages = {}
+    for (group, media_type, count, size) in rows:
+        for u in [usage, group_usages.setdefault(group, {'key': group, 'total': {'count': 0, 'size': 0}})]:
+            u.setdefault(media_type, {'count': 0, 'size': 0})
+            u[media_type]['count'] += count
+            u[media_type]['size'] += size
+            u['total']['count'] += count
+            u['total']['size'] += size
+
+    if groups:
+        usage['groups'] = [group_usages[k] for k in sorted(group_usages)]
+
+    return usage
+
+
+def _run_shared_listing(key, list_dir, func, callback, what, chunk_callback=None):
+    # identical listings that are requested while one is already running share its result;
+    # results are also cached for a little while, for as long as list_dir isn't modified
+    try:
+        mtime = os.stat(list_dir).st_mtime
+
+    except OSError:
+        mtime = None
+
+    now = time.time()
+    for (k, (t, m, l)) in _list_cache.items():  # @UnusedVariable
+        if now - t > _LIST_CACHE_TTL:
+            del _list_cache[k]
+
+    cached = _list_cache.get(key)
+    if cached and mtime is not None and cached[1] == mtime:
+        logging.debug('serving %(what)s listing from cache' % {'what': what})
+
+        media_list = cached[2]
+        if chunk_callback:
+            if media_list:
+                chunk_callback(media_list)
+
+            media_list = []
+
+        return callback(media_list)
+
+    if chunk_callback:
+        # streamed listings are not shared, since joining one midway would miss its first chunks
+        return _run_listing(func, callback, what, chunk_callback=chunk_callback)
+
+    waiters = _list_waiters.get(key)
+    if waiters is not None:
+        logging.debug('joining an identical %(what)s listing in progress' % {'what': what})
+        waiters.append(callback)
+
+        return
+
+    _list_waiters[key] = [callback]
+
+    def on_listing(media_list):
+        if media_list is not None and mtime is not None:
+            if len(_list_cache) >= _LIST_CACHE_MAX_ENTRIES:
+                oldest_key = min(_list_cache, key=lambda k: _list_cache[k][0])
+                del _list_cache[oldest_key]
+
+            _list_cache[key] = (time.time(), mtime, media_list)
+
+        for callback in _list_waiters.pop(key, []):
             callback(media_list)
-    
-    poll_process()
+
+    _run_listing(func, on_listing, what)
+
+
+def _invalidate_list_cache(camera_config):
+    # the mtime based validation is not enough when removing files,
+    # since the mtime resolution of some file systems is coarse;
+    # this may also be called from the worker threads that remove files
+    for key in _list_cache.keys():
+        if key[1] == camera_config['@id']:
+            _list_cache.pop(key, None)
+
+
+def _run_listing(func, callback, what, chunk_callback=None):
+    # runs func(send) in a worker thread and calls back with the list of objects it sent;
+    # with a chunk_callback, the objects are passed on in chunks as they are produced
+    logging.debug('starting %(what)s listing...' % {'what': what})
+
+    io_loop = IOLoop.instance()
+
+    def on_chunk(entries):
+        if not future.done(): # not timed out
+            chunk_callback(entries)
+
+    def do_list():
+        media_list = []
+
+        def send(entry):
+            media_list.append(entry)
+            if chunk_callback and len(media_list) >= _LIST_CHUNK_SIZE:
+                io_loop.add_callback(on_chunk, list(media_list))
+                del media_list[:]
+
+        func(send)
+
+        return media_list
+
+    def on_done(future):
+        try:
+            media_list = future.result()
+
+        except workers.TimeoutError:
+            logging.error('timeout waiting for the %(what)s listing to finish' % {'what': what})
+            return callback(None)
+
+        except Exception:
+            return callback(None) # already logged by the worker
+
+        if chunk_callback:
+            if media_list:
+                chunk_callback(media_list)
+
+            media_list = []
+
+        logging.debug('%(what)s listing has finished' % {'what': what})
+        callback(media_list)
+
+    future = workers.submit(do_list, settings.LIST_MEDIA_TIMEOUT)
+    io_loop.add_future(future, on_done)
+
+
+def groups_from_media_list(media_list):
+    # summarizes a full media list the way list_groups() does,
+    # for remote servers that don't know how to do it themselves
+    groups = {}
+    for entry in media_list:
+        key = os.path.dirname(entry['path']).lstrip('/')
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                'key': key,
+                'count': 0,
+                'size': None,
+                'sizeStr': None,
+                'firstTimestamp': entry['timestamp'],
+                'lastTimestamp': entry['timestamp']
+            }
+
+        group['count'] += 1
+        group['firstTimestamp'] = min(group['firstTimestamp'], entry['timestamp'])
+        group['lastTimestamp'] = max(group['lastTimestamp'], entry['timestamp'])
+
+    return [groups[k] for k in sorted(groups)]
 
 
 def get_media_content(camera_config, path, media_type):
@@ -392,27 +956,11 @@ def get_media_content(camera_config, path, media_type):
 def get_zipped_content(camera_config, media_type, group, callback):
     target_dir = camera_config.get('target_dir')
 
-    if media_type == 'picture':
-        exts = _PICTURE_EXTS
-        
-    elif media_type == 'movie':
-        exts = _MOVIE_EXTS
-        
-    working = multiprocessing.Value('b')
-    working.value = True
-
-    # create a subprocess to add files to zip
-    def do_zip(pipe):
-        mf = _list_media_files(target_dir, exts=exts, prefix=group)
-        paths = []
-        for (p, st) in mf:  # @UnusedVariable
-            path = p[len(target_dir):]
-            if path.startswith('/'):
-                path = path[1:]
-
-            paths.append(path)
+    def do_zip():
+        mf = _list_media_files(camera_config, media_type, prefix=group)
+        paths = [p[1:] for (p, timestamp, size) in mf]  # @UnusedVariable
             
-        zip_filename = os.path.join(settings.MEDIA_PATH, '.zip-%s' % int(time.time()))
+        zip_filename = os.path.join(settings.MEDIA_PATH, '.zip-%s-%s' % (int(time.time()), thread.get_ident()))
         logging.debug('adding %d files to zip file "%s"' % (len(paths), zip_filename))
 
         try:
@@ -424,9 +972,7 @@ def get_zipped_content(camera_config, media_type, group, callback):
         except Exception as e:
             logging.error('failed to create zip file "%s": %s' % (zip_filename, e))
 
-            working.value = False
-            pipe.close()
-            return
+            return None
 
         logging.debug('reading zip file "%s" into memory' % zip_filename)
 
@@ -434,56 +980,67 @@ def get_zipped_content(camera_config, media_type, group, callback):
             with open(zip_filename, mode='r') as f:
                 data = f.read()
 
-            working.value = False
-            pipe.send(data)
             logging.debug('zip data ready')
 
+            return data
+
         except Exception as e:
             logging.error('failed to read zip file "%s": %s' % (zip_filename, e))
-            working.value = False
 
         finally:
             os.remove(zip_filename)
-            pipe.close()
 
-    logging.debug('starting zip process...')
+    def on_zip(future):
+        try:
+            data = future.result()
 
-    (parent_pipe, child_pipe) = multiprocessing.Pipe(duplex=False)
-    process = multiprocessing.Process(target=do_zip, args=(child_pipe, ))
-    process.start()
+        except workers.TimeoutError:
+            logging.error('timeout waiting for the zip job to finish')
+            data = None
 
-    # poll the subprocess to see when it has finished
-    started = datetime.datetime.now()
+        except Exception:
+            data = None # already logged by the worker
 
-    def poll_process():
-        io_loop = IOLoop.instance()
-        if working.value:
-            now = datetime.datetime.now()
-            delta = now - started
-            if delta.seconds < settings.ZIP_TIMEOUT:
-                io_loop.add_timeout(datetime.timedelta(seconds=0.5), poll_process)
-
-            else: # process did not finish in time
-                logging.error('timeout waiting for the zip process to finish')
-                try:
-                    os.kill(process.pid, signal.SIGTERM)
-                
-                except:
-                    pass # nevermind
+        if data is not None:
+            logging.debug('zip job has returned %d bytes' % len(data))
 
-                callback(None)
+        callback(data)
 
-        else: # finished
-            try:
-                data = parent_pipe.recv()
-                logging.debug('zip process has returned %d bytes' % len(data))
-                
-            except:
-                data = None
-            
-            callback(data)
+    logging.debug('starting zip job...')
+
+    _flush_media_watch(camera_config)
+    future = workers.submit(do_zip, settings.ZIP_TIMEOUT)
+    IOLoop.instance().add_future(future, on_zip)
+
+
+def get_zipped_frames(camera_config, frames, width, height, callback):
+    # frames are (time, seq, jpg) tuples, as returned by mjpgclient.get_history()
+    def do_zip():
+        sio = StringIO.StringIO()
+        with zipfile.ZipFile(sio, mode='w') as f:
+            for (timestamp, seq, jpg) in frames:  # @UnusedVariable
+                path = datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d/%H-%M-%S-%f')[:-3] + '.jpg'
+                f.writestr(path, resize_picture(camera_config, jpg, width, height))
+
+        return sio.getvalue()
+
+    def on_zip(future):
+        try:
+            data = future.result()
+
+        except workers.TimeoutError:
+            logging.error('timeout waiting for the frames zip job to finish')
+            data = None
+
+        except Exception:
+            data = None # already logged by the worker
+
+        callback(data)
+
+    logging.debug('zipping %d frames...' % len(frames))
 
-    poll_process()
+    future = workers.submit(do_zip, settings.ZIP_TIMEOUT)
+    IOLoop.instance().add_future(future, on_zip)
 
 
 def make_timelapse_movie(camera_config, framerate, interval, group):
@@ -496,66 +1053,43 @@ def make_timelapse_movie(camera_config, framerate, interval, group):
     codec = FFMPEG_CODEC_MAPPING.get(codec, codec)
     format = FFMPEG_FORMAT_MAPPING.get(codec, codec)
 
-    # create a subprocess to retrieve media files
-    def do_list_media(pipe):
-        mf = _list_media_files(target_dir, exts=_PICTURE_EXTS, prefix=group)
-        for (p, st) in mf:
-            timestamp = st.st_mtime
+    def do_list_media():
+        mf = _list_media_files(camera_config, 'picture', prefix=group)
 
-            pipe.send({
-                'path': p,
-                'timestamp': timestamp
-            })
+        return [{'path': os.path.join(target_dir, p[1:]), 'timestamp': timestamp}
+                for (p, timestamp, size) in mf]  # @UnusedVariable
 
-        pipe.close()
+    logging.debug('starting media listing job...')
 
-    logging.debug('starting media listing process...')
-    
-    (parent_pipe, child_pipe) = multiprocessing.Pipe(duplex=False)
-    _timelapse_process = multiprocessing.Process(target=do_list_media, args=(child_pipe, ))
+    _flush_media_watch(camera_config)
+    _timelapse_process = workers.submit(do_list_media, settings.TIMELAPSE_TIMEOUT)
     _timelapse_process.progress = 0
-    _timelapse_process.start()
     _timelapse_data = None
 
-    started = [datetime.datetime.now()]
-    media_list = []
-    
     tmp_filename = os.path.join(settings.MEDIA_PATH, '.%s.avi' % int(time.time()))
 
-    def read_media_list():
-        while parent_pipe.poll():
-            media_list.append(parent_pipe.recv())
-        
-    def poll_media_list_process():
-        io_loop = IOLoop.instance()
-        if _timelapse_process.is_alive(): # not finished yet
-            now = datetime.datetime.now()
-            delta = now - started[0]
-            if delta.seconds < settings.TIMELAPSE_TIMEOUT: # the subprocess has limited time to complete its job
-                io_loop.add_timeout(datetime.timedelta(seconds=0.5), poll_media_list_process)
-                read_media_list()
-
-            else: # process did not finish in time
-                logging.error('timeout waiting for the media listing process to finish')
-                try:
-                    os.kill(_timelapse_process.pid, signal.SIGTERM)
-                
-                except:
-                    pass # nevermind
+    def on_media_list(future):
+        try:
+            media_list = future.result()
 
-                _timelapse_process.progress = -1
+        except workers.TimeoutError:
+            logging.error('timeout waiting for the media listing job to finish')
+            future.progress = -1
+            return
 
-        else: # finished
-            read_media_list()
-            logging.debug('media listing process has returned %(count)s files' % {'count': len(media_list)})
-            
-            if not media_list:
-                _timelapse_process.progress = -1
-                
-                return
+        except Exception:
+            future.progress = -1 # already logged by the worker
+            return
+
+        logging.debug('media listing job has returned %(count)s files' % {'count': len(media_list)})
 
-            pictures = select_pictures(media_list)
-            make_movie(pictures)
+        if not media_list:
+            future.progress = -1
+
+            return
+
+        pictures = select_pictures(media_list)
+        make_movie(pictures)
 
     def select_pictures(media_list):
         media_list.sort(key=lambda e: e['timestamp'])
@@ -673,13 +1207,13 @@ def make_timelapse_movie(camera_config, framerate, interval, group):
                     except:
                         pass
 
-    poll_media_list_process()
+    IOLoop.instance().add_future(_timelapse_process, on_media_list)
 
 
 def check_timelapse_movie():
     if _timelapse_process:
         if ((hasattr(_timelapse_process, 'poll') and _timelapse_process.poll() is None) or
-            (hasattr(_timelapse_process, 'is_alive') and _timelapse_process.is_alive())):
+            (hasattr(_timelapse_process, 'done') and not _timelapse_process.done())):
         
             return {'progress': _timelapse_process.progress, 'data': None}
         
@@ -729,7 +1263,7 @@ def get_media_preview(camera_config, path, media_type, width, height):
     width = width and int(width) or image.size[0]
     height = height and int(height) or image.size[1]
     
-    image.thumbnail((width, height), Image.LINEAR)
+    image = _shrink_image(image, width, height, Image.LINEAR)
 
     sio = StringIO.StringIO()
     image.save(sio, format='JPEG')
@@ -737,68 +1271,115 @@ def get_media_preview(camera_config, path, media_type, width, height):
     return sio.getvalue()
 
 
-def del_media_content(camera_config, path, media_type):
+def del_media_content(camera_config, path, media_type, callback):
+    # removes a media file in a worker thread, calling back with an error message (or None) when done
     target_dir = camera_config.get('target_dir')
 
-    full_path = os.path.join(target_dir, path)
+    def do_delete():
+        full_path = os.path.join(target_dir, path)
 
-    # create a sentinel file to make sure the target dir is never removed
-    open(os.path.join(target_dir, '.keep'), 'w').close()
+        # create a sentinel file to make sure the target dir is never removed
+        open(os.path.join(target_dir, '.keep'), 'w').close()
     
-    try:
-        # remove the file itself
-        os.remove(full_path)
-        
-        # remove the thumb file
         try:
-            os.remove(full_path + '.thumb')
+            # remove the file itself
+            os.remove(full_path)
         
-        except:
-            pass
+            # remove the thumb file
+            try:
+                os.remove(full_path + '.thumb')
+        
+            except:
+                pass
 
-        # remove the parent directories if empty or contains only thumb files
-        dir_path = os.path.dirname(full_path)
-        listing = os.listdir(dir_path)
-        thumbs = [l for l in listing if l.endswith('.thumb')]
+            mediaindex.remove(camera_config, ['/' + path.lstrip('/')])
+            _invalidate_list_cache(camera_config)
+
+            # remove the parent directories if empty or contains only thumb files
+            dir_path = os.path.dirname(full_path)
+            listing = os.listdir(dir_path)
+            thumbs = [l for l in listing if l.endswith('.thumb')]
         
-        if len(listing) == len(thumbs): # only thumbs
-            for p in thumbs:
-                os.remove(os.path.join(dir_path, p))
+            if len(listing) == len(thumbs): # only thumbs
+                for p in thumbs:
+                    os.remove(os.path.join(dir_path, p))
 
-        if not listing or len(listing) == len(thumbs):
-            logging.debug('removing empty directory %(path)s...' % {'path': dir_path})
-            os.removedirs(dir_path)
+            if not listing or len(listing) == len(thumbs):
+                logging.debug('removing empty directory %(path)s...' % {'path': dir_path})
+                os.removedirs(dir_path)
     
-    except Exception as e:
-        logging.error('failed to remove file %(path)s: %(msg)s' % {
-                'path': full_path, 'msg': unicode(e)})
+        except Exception as e:
+            logging.error('failed to remove file %(path)s: %(msg)s' % {
+                    'path': full_path, 'msg': unicode(e)})
         
-        raise
+            raise
 
+    def on_done(future):
+        _invalidate_list_cache(camera_config)
 
-def del_media_group(camera_config, group, media_type):
-    if media_type == 'picture':
-        exts = _PICTURE_EXTS
-        
-    elif media_type == 'movie':
-        exts = _MOVIE_EXTS
-        
+        try:
+            future.result()
+
+        except workers.TimeoutError:
+            logging.error('timeout waiting for %(media_type)s %(path)s of camera %(id)s to be deleted' % {
+                    'media_type': media_type, 'path': path, 'id': camera_config['@id']})
+
+            return callback('Timeout waiting for the file to be deleted.')
+
+        except Exception as e:
+            return callback(unicode(e)) # already logged by the worker
+
+        callback(None)
+
+    IOLoop.instance().add_future(workers.submit_background(do_delete, settings.DELETE_MEDIA_TIMEOUT), on_done)
+
+
+def del_media_group(camera_config, group, media_type, job=None):
+    # when given a deletion job, its progress is updated as files are removed
+    # and the removal stops as soon as the job gets cancelled
     target_dir = camera_config.get('target_dir')
     full_path = os.path.join(target_dir, group)
 
     # create a sentinel file to make sure the target dir is never removed
     open(os.path.join(target_dir, '.keep'), 'w').close()
 
-    mf = _list_media_files(target_dir, exts=exts, prefix=group)
-    for (path, st) in mf:  # @UnusedVariable
-        try:
-            os.remove(path)
+    mf = _list_media_files(camera_config, media_type, prefix=group)
+    if job:
+        job['total'] = len(mf)
+
+    removed = []
+    try:
+        for (path, timestamp, size) in mf:  # @UnusedVariable
+            if job and job['cancelled']:
+                logging.debug('deletion of group "%(group)s" of camera %(id)s cancelled' % {
+                        'group': group or 'ungrouped', 'id': camera_config['@id']})
+
+                return
+
+            file_path = os.path.join(target_dir, path[1:])
+            try:
+                os.remove(file_path)
+        
+            except Exception as e:
+                logging.error('failed to remove file %(path)s: %(msg)s' % {
+                        'path': file_path, 'msg': unicode(e)})
     
-        except Exception as e:
-            logging.error('failed to remove file %(path)s: %(msg)s' % {
-                    'path': full_path, 'msg': unicode(e)})
+                raise
 
-            raise
+            # remove the thumb file, if any
+            try:
+                os.remove(file_path + '.thumb')
+
+            except OSError:
+                pass
+            
+            removed.append(path)
+            if job:
+                job['removed'] = len(removed)
+
+    finally:
+        mediaindex.remove(camera_config, removed)
+        _invalidate_list_cache(camera_config)
 
     # remove the group directory if empty or contains only thumb files
     listing = os.listdir(full_path)
@@ -811,16 +1392,291 @@ def del_media_group(camera_config, group, media_type):
     if not listing or len(listing) == len(thumbs):
         logging.debug('removing empty directory %(path)s...' % {'path': full_path})
         os.removedirs(full_path)
+        mediaindex.remove_dir(camera_config, group)
+
+
+def start_media_group_deletion(camera_config, group, media_type, callback=None):
+    # deletes a group of media files in a worker thread, calling back with an error message (or None)
+    # when done; returns the id of the deletion job, to be used with check/cancel_media_group_deletion()
+    for job in _deletion_jobs.itervalues():
+        if (job['camera_id'], job['group'], job['media_type']) == (camera_config['@id'], group, media_type) and \
+                not job['done'] and not job['cancelled']:
+
+            logging.debug('group "%(group)s" of camera %(id)s is already being deleted' % {
+                    'group': group or 'ungrouped', 'id': camera_config['@id']})
+
+            if callback:
+                job['callbacks'].append(callback)
+
+            return job['id']
+
+    job_id = hashlib.sha1(str(time.time()) + group + media_type + str(camera_config['@id'])).hexdigest()
+    job = {
+        'id': job_id,
+        'camera_id': camera_config['@id'],
+        'group': group,
+        'media_type': media_type,
+        'total': None,
+        'removed': 0,
+        'cancelled': False,
+        'done': False,
+        'error': None,
+        'callbacks': [callback] if callback else []
+    }
+
+    _deletion_jobs[job_id] = job
+
+    def run_callbacks(error):
+        callbacks, job['callbacks'] = job['callbacks'], []
+        for c in callbacks:
+            c(error)
+
+    def do_delete():
+        # the job is only done once the worker returns, even if the callers stopped waiting for it
+        try:
+            del_media_group(camera_config, group, media_type, job=job)
+
+        except Exception as e:
+            io_loop.add_callback(on_finished, unicode(e)) # already logged by the worker
+            raise
 
+        io_loop.add_callback(on_finished, None)
 
-def get_current_picture(camera_config, width, height):
-    import mjpgclient
+    def on_finished(error):
+        job['error'] = error
+        job['done'] = True
+        _invalidate_list_cache(camera_config)
 
-    jpg = mjpgclient.get_jpg(camera_config['@id'])
-    
-    if jpg is None:
+        def forget():
+            _deletion_jobs.pop(job_id, None)
+
+        io_loop.add_timeout(datetime.timedelta(seconds=_DELETION_JOB_TTL), forget)
+
+        run_callbacks(error)
+
+    def on_done(future):
+        try:
+            future.result()
+
+        except workers.TimeoutError:
+            # the deletion goes on in its thread, to be reported by check_media_group_deletion()
+            logging.error('timeout waiting for the deletion of group "%(group)s" of camera %(id)s' % {
+                    'group': group or 'ungrouped', 'id': camera_config['@id']})
+
+            run_callbacks('Timeout waiting for the files to be deleted.')
+
+        except Exception:
+            pass # handled by on_finished()
+
+    logging.debug('starting deletion job %(job)s for group "%(group)s" of camera %(id)s...' % {
+            'job': job_id, 'group': group or 'ungrouped', 'id': camera_config['@id']})
+
+    io_loop = IOLoop.instance()
+    _flush_media_watch(camera_config)
+    io_loop.add_future(workers.submit_background(do_delete, settings.DELETE_MEDIA_TIMEOUT), on_done)
+
+    return job_id
+
+
+def check_media_group_deletion(job_id):
+    # returns the status of a deletion job, or None if there is no such job;
+    # progress goes from 0 to 1, just like the timelapse progress
+    job = _deletion_jobs.get(job_id)
+    if job is None:
         return None
-    
+
+    if job['total']:
+        progress = float(job['removed']) / job['total']
+
+    else:
+        progress = 1 if job['done'] else 0
+
+    return {
+        'jobId': job['id'],
+        'progress': progress,
+        'removed': job['removed'],
+        'total': job['total'],
+        'done': job['done'],
+        'cancelled': job['cancelled'],
+        'error': job['error']
+    }
+
+
+def cancel_media_group_deletion(job_id):
+    # the files removed so far stay removed; returns False if there is no such job
+    job = _deletion_jobs.get(job_id)
+    if job is None:
+        return False
+
+    if not job['done']:
+        logging.debug('cancelling deletion job %(job)s...' % {'job': job_id})
+        job['cancelled'] = True
+
+    return True
+
+
+def del_media_files(camera_config, media_type, callback, paths=None, since=None, until=None):
+    # deletes the given media files, or those in the given time range, in one pass,
+    # cleaning up the directories left empty at the end; calls back with the number
+    # of removed files and the paths that could not be removed, or with None on error
+    target_dir = camera_config.get('target_dir')
+    exts = _PICTURE_EXTS if media_type == 'picture' else _MOVIE_EXTS
+
+    def do_delete():
+        # create a sentinel file to make sure the target dir is never removed
+        open(os.path.join(target_dir, '.keep'), 'w').close()
+
+        if paths is None:
+            mf = _list_media_files(camera_config, media_type, since=since, until=until)
+            rel_paths = [p for (p, t, s) in mf]  # @UnusedVariable
+
+        else:
+            rel_paths = []
+            for path in paths:
+                path = os.path.normpath('/' + path.lstrip('/')) # never outside the target dir
+                if not [e for e in exts if path.lower().endswith(e)]:
+                    logging.warning('refusing to delete %(path)s: not a %(media_type)s' % {
+                            'path': path, 'media_type': media_type})
+
+                    continue
+
+                rel_paths.append(path)
+
+        removed = []
+        missing = []
+        failed = []
+        dir_paths = set()
+        for path in rel_paths:
+            full_path = os.path.join(target_dir, path[1:])
+            try:
+                os.remove(full_path)
+
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    missing.append(path) # might still be known to the index
+                    continue
+
+                logging.error('failed to remove file %(path)s: %(msg)s' % {
+                        'path': full_path, 'msg': unicode(e)})
+
+                failed.append(path)
+                continue
+
+            try:
+                os.remove(full_path + '.thumb')
+
+            except OSError:
+                pass
+
+            removed.append(path)
+            dir_paths.add(os.path.dirname(full_path))
+
+        mediaindex.remove(camera_config, removed + missing)
+        _remove_empty_dirs(target_dir, dir_paths)
+
+        return {'removed': len(removed), 'failed': failed}
+
+    def on_done(future):
+        _invalidate_list_cache(camera_config)
+
+        try:
+            result = future.result()
+
+        except workers.TimeoutError:
+            logging.error('timeout waiting for the %(media_type)ss of camera %(id)s to be deleted' % {
+                    'media_type': media_type, 'id': camera_config['@id']})
+
+            return callback(None)
+
+        except Exception:
+            return callback(None) # already logged by the worker
+
+        logging.debug('deleted %(count)s %(media_type)ss of camera %(id)s' % {
+                'count': result['removed'], 'media_type': media_type, 'id': camera_config['@id']})
+
+        callback(result)
+
+    if paths is None:
+        _flush_media_watch(camera_config)
+
+    IOLoop.instance().add_future(workers.submit_background(do_delete, settings.DELETE_MEDIA_TIMEOUT), on_done)
+
+
+def resize_frame(camera_config, jpg, seq, width, height):
+    # like resize_picture(), but each size of a frame is only computed once,
+    # no matter how many clients ask for it; only the sizes of the last frame of each camera are kept
+    if width is height is None:
+        return jpg
+
+    camera_id = camera_config['@id']
+    cache = _resized_frames.get(camera_id)
+    if cache is None or cache['seq'] < seq:
+        cache = _resized_frames[camera_id] = {'seq': seq, 'sizes': {}}
+
+    elif cache['seq'] > seq:
+        return resize_picture(camera_config, jpg, width, height) # an old frame, not worth caching
+
+    key = (width, height)
+    resized = cache['sizes'].get(key)
+    if resized is None:
+        resized = resize_picture(camera_config, jpg, width, height)
+        if len(cache['sizes']) < _RESIZED_FRAME_CACHE_SIZE:
+            cache['sizes'][key] = resized
+
+    return resized
+
+
+def get_mosaic(camera_ids, width, height):
+    # composes the last frames of the given cameras into a single picture of width x height, laid out in a grid;
+    # the tiles come from the resized frames cache and an unchanged mosaic is returned as it is
+    import mjpgclient
+
+    columns = int(math.ceil(math.sqrt(len(camera_ids))))
+    rows = int(math.ceil(len(camera_ids) / float(columns)))
+    tile_width = width / columns
+    tile_height = height / rows
+
+    frames = [mjpgclient.get_frame(camera_id) for camera_id in camera_ids]
+    seqs = tuple(seq for (jpg, seq) in frames)  # @UnusedVariable
+
+    key = (tuple(camera_ids), width, height)
+    mosaic = _mosaics.get(key)
+    if mosaic and mosaic['seqs'] == seqs:
+        return mosaic['jpg']
+
+    image = Image.new('RGB', (width, height))
+    for i, (camera_id, (jpg, seq)) in enumerate(zip(camera_ids, frames)):
+        if jpg is None:
+            continue # the camera has no frame (yet), its tile is left black
+
+        camera_config = config.get_camera(camera_id)
+        tile = resize_frame(camera_config, jpg, seq, tile_width, tile_height)
+
+        try:
+            tile = Image.open(StringIO.StringIO(tile))
+
+        except Exception as e:
+            logging.error('failed to open frame of camera %(id)s: %(msg)s' % {'id': camera_id, 'msg': unicode(e)})
+            continue
+
+        # center the frame within its tile
+        x = (i % columns) * tile_width + (tile_width - tile.size[0]) / 2
+        y = (i / columns) * tile_height + (tile_height - tile.size[1]) / 2
+        image.paste(tile, (x, y))
+
+    sio = StringIO.StringIO()
+    image.save(sio, format='JPEG')
+
+    if key not in _mosaics and len(_mosaics) >= _MOSAIC_CACHE_SIZE:
+        _mosaics.clear()
+
+    _mosaics[key] = {'seqs': seqs, 'jpg': sio.getvalue()}
+
+    return _mosaics[key]['jpg']
+
+
+def resize_picture(camera_config, jpg, width, height):
+    # width and height are either pixels or fractions of the original size
     if width is height is None:
         return jpg # no server-side resize needed
 
@@ -845,7 +1701,7 @@ def get_current_picture(camera_config, width, height):
     if width >= image.size[0] and height >= image.size[1]:
         return jpg # no enlarging of the picture on the server side
     
-    image.thumbnail((width, height), Image.CUBIC)
+    image = _shrink_image(image, width, height, Image.CUBIC)
 
     sio = StringIO.StringIO()
     image.save(sio, format='JPEG')
@@ -853,6 +1709,34 @@ def get_current_picture(camera_config, width, height):
     return sio.getvalue()
 
 
+def _shrink_image(image, width, height, resample):
+    # like Image.thumbnail(), fits the image within width x height, keeping its aspect ratio
+    x, y = image.size
+    if x > width:
+        y = int(max(y * width / x, 1))
+        x = int(width)
+    if y > height:
+        x = int(max(x * height / y, 1))
+        y = int(height)
+
+    if (x, y) == image.size:
+        return image
+
+    if image.format == 'JPEG' and x * 2 <= image.size[0] and y * 2 <= image.size[1]:
+        # let libjpeg decode the picture directly at 1/2, 1/4 or 1/8 of its size,
+        # skipping most of the decoding work; the rest of the way is done by resize()
+        image.draft(image.mode, (x, y))
+
+    quality_filter = _RESAMPLE_FILTERS.get(settings.RESIZE_QUALITY)
+    if quality_filter is not None: # Image.NEAREST is 0
+        resample = quality_filter
+
+    if image.size != (x, y):
+        image = image.resize((x, y), resample)
+
+    return image
+
+
 def get_prepared_cache(key):
     return _prepared_files.pop(key, None)
 
@@ -0,0 +1,461 @@
+
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os.path
+import sqlite3
+import stat
+import thread
+import time
+
+import mediafiles
+import settings
+
+
+_DB_FILE_NAME = 'mediaindex-%(id)s.db'
+_SCHEMA_VERSION = 2
+
+# directories (and files) that have been modified more recently than this
+# number of seconds are rescanned at the next sync, since motion may still be
+# writing to them and the mtime resolution of some file systems is coarse
+_SETTLE_TIME = 60
+
+# timeout in seconds to wait for another process to release the database lock
+_LOCK_TIMEOUT = 30
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, parent TEXT, mtime REAL);
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, name TEXT, type TEXT,
+        mtime REAL, size INTEGER, thumb INTEGER);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE INDEX IF NOT EXISTS files_type_mtime ON files (type, mtime);
+CREATE INDEX IF NOT EXISTS files_dir_type_mtime ON files (dir, type, mtime);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime);
+
+-- file count and total size per directory and type, maintained by triggers;
+-- INSERT OR IGNORE can't be used in the triggers, since the conflict clause
+-- of the outer INSERT OR REPLACE statements would take precedence
+CREATE TABLE IF NOT EXISTS stats (dir TEXT, type TEXT, count INTEGER, size INTEGER, PRIMARY KEY (dir, type));
+
+CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+    INSERT INTO stats (dir, type, count, size) SELECT NEW.dir, NEW.type, 0, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats WHERE dir = NEW.dir AND type = NEW.type);
+    UPDATE stats SET count = count + 1, size = size + NEW.size WHERE dir = NEW.dir AND type = NEW.type;
+END;
+
+CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+    UPDATE stats SET count = count - 1, size = size - OLD.size WHERE dir = OLD.dir AND type = OLD.type;
+    DELETE FROM stats WHERE dir = OLD.dir AND type = OLD.type AND count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF dir, type, size ON files BEGIN
+    UPDATE stats SET count = count - 1, size = size - OLD.size WHERE dir = OLD.dir AND type = OLD.type;
+    DELETE FROM stats WHERE dir = OLD.dir AND type = OLD.type AND count <= 0;
+    INSERT INTO stats (dir, type, count, size) SELECT NEW.dir, NEW.type, 0, 0
+            WHERE NOT EXISTS (SELECT 1 FROM stats WHERE dir = NEW.dir AND type = NEW.type);
+    UPDATE stats SET count = count + 1, size = size + NEW.size WHERE dir = NEW.dir AND type = NEW.type;
+END;
+'''
+
+# connections can't be shared between processes or threads,
+# so they are indexed by (pid, thread id, camera id)
+_connections = {}
+
+# the target dir each index has been (re)initialized for in this process, indexed by camera id
+_ready = {}
+
+
+def sync(camera_config, group=None):
+    # when a group is given, only the corresponding directory is synced
+    _sync(camera_config, None if group is None else [group])
+
+
+def sync_groups(camera_config, groups):
+    # syncs only the directories of the given groups, reading the known directories once for all of them
+    _sync(camera_config, groups)
+
+
+def _sync(camera_config, groups):
+    db = _get_db(camera_config)
+    target_dir = camera_config['target_dir']
+
+    started = time.time()
+    known = dict(db.execute('SELECT path, mtime FROM dirs'))
+    children = {}
+    for (path, parent) in db.execute("SELECT path, parent FROM dirs WHERE path != ''"):
+        children.setdefault(parent, []).append(path)
+
+    if not os.path.isdir(target_dir):
+        logging.debug('target dir %(path)s does not exist, clearing media index' % {'path': target_dir})
+        with db:
+            db.execute('DELETE FROM files')
+            db.execute('DELETE FROM dirs')
+
+        return
+
+    seen = set()
+    pending = [''] if groups is None else list(groups)
+    scanned = 0
+    while pending:
+        rel_dir = pending.pop()
+        seen.add(rel_dir)
+
+        try:
+            st = os.stat(os.path.join(target_dir, rel_dir))
+
+        except OSError:
+            _forget_dir(db, rel_dir)
+            continue
+
+        if known.get(rel_dir) == st.st_mtime:
+            # nothing added or removed since the last scan
+            subdirs = children.get(rel_dir, [])
+
+        else:
+            subdirs = _scan_dir(db, target_dir, rel_dir, st)
+            scanned += 1
+
+        if groups is None:
+            pending.extend(subdirs)
+
+    if groups is None:
+        for rel_dir in known:
+            if rel_dir not in seen: # parent has been removed or rescanned
+                _forget_dir(db, rel_dir)
+
+    logging.debug('media index for %(path)s synced in %(time).3fs (%(scanned)s/%(total)s dirs scanned)' % {
+            'path': target_dir if groups is None else ', '.join(os.path.join(target_dir, g) for g in groups),
+            'time': time.time() - started,
+            'scanned': scanned, 'total': len(seen)})
+
+
+def find(camera_config, media_type, group=None, since=None, until=None, after=None, limit=None, reverse=False):
+    # media_type can also be a list of types;
+    # after is a (mtime, path) pair designating the last entry of a previous page;
+    # entries are ordered by (mtime, path), which makes the order stable between pages
+    db = _get_db(camera_config)
+
+    if isinstance(media_type, list):
+        query = 'SELECT path, mtime, size FROM files WHERE type IN (%s)' % ', '.join(['?'] * len(media_type))
+        params = list(media_type)
+
+    else:
+        query = 'SELECT path, mtime, size FROM files WHERE type = ?'
+        params = [media_type]
+
+    if group is not None:
+        query += ' AND dir = ?'
+        params.append(group)
+
+    if since is not None:
+        query += ' AND mtime >= ?'
+        params.append(since)
+
+    if until is not None:
+        query += ' AND mtime < ?'
+        params.append(until)
+
+    if after is not None:
+        op = '<' if reverse else '>'
+        query += ' AND (mtime %(op)s ? OR (mtime = ? AND path %(op)s ?))' % {'op': op}
+        params.extend([after[0], after[0], after[1]])
+
+    if reverse:
+        query += ' ORDER BY mtime DESC, path DESC'
+
+    else:
+        query += ' ORDER BY mtime, path'
+
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+
+    return db.execute(query, params).fetchall()
+
+
+def find_groups(camera_config, media_type):
+    # returns (group, count, total size, first mtime, last mtime) for each directory
+    # that contains files of the given type
+    db = _get_db(camera_config)
+
+    return db.execute('SELECT dir, COUNT(*), SUM(size), MIN(mtime), MAX(mtime) FROM files '
+            'WHERE type = ? GROUP BY dir ORDER BY dir', (media_type,)).fetchall()
+
+
+def find_expired_dirs(camera_config, media_type, until):
+    # returns (group, file count) for each directory without subdirectories
+    # whose files are all of the given type and older than until,
+    # i.e. the directories that can be removed as a whole
+    db = _get_db(camera_config)
+
+    return db.execute("SELECT dir, COUNT(*) FROM files WHERE dir != '' "
+            'AND dir NOT IN (SELECT parent FROM dirs WHERE parent IS NOT NULL) '
+            'GROUP BY dir HAVING MAX(mtime) < ? AND SUM(type != ?) = 0 ORDER BY dir',
+            (until, media_type)).fetchall()
+
+
+def find_empty_dirs(camera_config, until):
+    # returns the directories without subdirectories that hold no media files (but possibly
+    # orphan thumbs) and haven't been modified since until, as of their last scan
+    db = _get_db(camera_config)
+
+    return [path for (path,) in db.execute("SELECT path FROM dirs WHERE path != '' AND mtime < ? "
+            'AND path NOT IN (SELECT parent FROM dirs WHERE parent IS NOT NULL) '
+            'AND path NOT IN (SELECT dir FROM stats) ORDER BY path', (until,))]
+
+
+def is_ready(camera_config):
+    # tells whether the index can be used without being (re)initialized first,
+    # which may take a while and is better left to a worker thread
+    return _ready.get(camera_config['@id']) == camera_config['target_dir']
+
+
+def init(camera_config):
+    _get_db(camera_config)
+
+
+def get_usage(camera_config):
+    # returns (group, type, count, total size) for each directory and file type,
+    # without having to go through the files
+    db = _get_db(camera_config)
+
+    return db.execute('SELECT dir, type, count, size FROM stats ORDER BY dir').fetchall()
+
+
+def has_thumb(camera_config, path):
+    db = _get_db(camera_config)
+    row = db.execute('SELECT thumb FROM files WHERE path = ?', (path,)).fetchone()
+
+    return bool(row and row[0])
+
+
+def update(camera_config, full_paths):
+    # brings the entries of the given files up to date, without scanning their directories
+    db = _get_db(camera_config)
+    target_dir = camera_config['target_dir']
+
+    with db:
+        for full_path in full_paths:
+            rel_path = os.path.relpath(full_path, target_dir)
+            if rel_path.startswith('..'):
+                continue # not in the target dir
+
+            rel_dir, name = os.path.split(rel_path)
+            if name.startswith('.') or name == 'lastsnap.jpg':
+                continue
+
+            if name.endswith('.thumb'):
+                db.execute('UPDATE files SET thumb = ? WHERE path = ?',
+                        (int(os.path.exists(full_path)), _make_path(rel_dir, name[:-6])))
+
+                continue
+
+            path = _make_path(rel_dir, name)
+
+            try:
+                st = os.lstat(full_path)
+
+            except OSError:
+                db.execute('DELETE FROM files WHERE path = ?', (path,))
+                continue
+
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+            db.execute('INSERT OR REPLACE INTO files (path, dir, name, type, mtime, size, thumb) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)', (path, rel_dir, name, _media_type(name), st.st_mtime, st.st_size,
+                            int(os.path.exists(full_path + '.thumb'))))
+
+            # make sure the directory is known to the index; it will be scanned at the next sync
+            while db.execute('SELECT 1 FROM dirs WHERE path = ?', (rel_dir,)).fetchone() is None:
+                parent = os.path.dirname(rel_dir) if rel_dir else None
+                db.execute('INSERT INTO dirs (path, parent, mtime) VALUES (?, ?, NULL)', (rel_dir, parent))
+                if parent is None:
+                    break
+
+                rel_dir = parent
+
+
+def list_dirs(camera_config):
+    db = _get_db(camera_config)
+
+    return [path for (path,) in db.execute('SELECT path FROM dirs')]
+
+
+def get_dir_mtimes(camera_config):
+    # the modification times of the directories, as of their last scan, indexed by path
+    db = _get_db(camera_config)
+
+    return dict(db.execute('SELECT path, mtime FROM dirs'))
+
+
+def remove(camera_config, paths):
+    db = _get_db(camera_config)
+    with db:
+        db.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in paths])
+
+
+def remove_dir(camera_config, rel_dir):
+    _forget_dir(_get_db(camera_config), rel_dir)
+
+
+def _get_db(camera_config):
+    camera_id = camera_config['@id']
+    key = (os.getpid(), thread.get_ident(), camera_id)
+    db = _connections.get(key)
+    if db is None:
+        file_path = os.path.join(settings.CONF_PATH, _DB_FILE_NAME % {'id': camera_id})
+        logging.debug('opening media index "%s"...' % file_path)
+
+        db = sqlite3.connect(file_path, timeout=_LOCK_TIMEOUT)
+        db.text_factory = str # keep paths as byte strings, like os.listdir() does
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('PRAGMA recursive_triggers = ON') # so that replaced rows are accounted as deleted
+        db.executescript(_SCHEMA)
+
+        _connections[key] = db
+
+    target_dir = camera_config['target_dir']
+    if _ready.get(camera_id) == target_dir:
+        return db
+
+    if _get_meta(db, 'target_dir') != target_dir or _get_meta(db, 'version') != str(_SCHEMA_VERSION):
+        logging.debug('(re)initializing media index for camera %(id)s with target dir %(path)s' % {
+                'id': camera_id, 'path': target_dir})
+
+        # the tables are dropped rather than emptied, so that the stats triggers don't fire for every file
+        with db:
+            db.execute('DROP TABLE IF EXISTS files')
+            db.execute('DROP TABLE IF EXISTS dirs')
+            db.execute('DROP TABLE IF EXISTS stats')
+
+        db.executescript(_SCHEMA)
+        with db:
+            _set_meta(db, 'target_dir', target_dir)
+            _set_meta(db, 'version', str(_SCHEMA_VERSION))
+
+    _ready[camera_id] = target_dir
+
+    return db
+
+
+def _get_meta(db, key):
+    row = db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+
+    return row and row[0]
+
+
+def _set_meta(db, key, value):
+    db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+
+def _media_type(name):
+    name = name.lower()
+    if [e for e in mediafiles._PICTURE_EXTS if name.endswith(e)]:
+        return 'picture'
+
+    elif [e for e in mediafiles._MOVIE_EXTS if name.endswith(e)]:
+        return 'movie'
+
+    else:
+        return 'other'
+
+
+def _make_path(rel_dir, name):
+    if rel_dir:
+        return '/' + rel_dir + '/' + name
+
+    else:
+        return '/' + name
+
+
+def _scan_dir(db, target_dir, rel_dir, dir_st):
+    full_dir = os.path.join(target_dir, rel_dir)
+    now = time.time()
+    settled = now - dir_st.st_mtime > _SETTLE_TIME
+
+    try:
+        names = os.listdir(full_dir)
+
+    except OSError as e:
+        logging.error('failed to list directory %(path)s: %(msg)s' % {'path': full_dir, 'msg': unicode(e)})
+
+        return []
+
+    names_set = set(names)
+    subdirs = []
+    files = {}
+    for name in names:
+        # ignore hidden files/dirs and other unwanted files
+        if name.startswith('.') or name == 'lastsnap.jpg' or name.endswith('.thumb'):
+            continue
+
+        try:
+            st = os.lstat(os.path.join(full_dir, name))
+
+        except OSError:
+            continue # removed in the meantime
+
+        if stat.S_ISDIR(st.st_mode):
+            subdirs.append(os.path.join(rel_dir, name))
+
+        elif stat.S_ISREG(st.st_mode):
+            files[_make_path(rel_dir, name)] = (name, _media_type(name), st.st_mtime, st.st_size,
+                    int(name + '.thumb' in names_set))
+
+            if now - st.st_mtime <= _SETTLE_TIME:
+                settled = False # still being written
+
+    existing = {}
+    for row in db.execute('SELECT path, name, type, mtime, size, thumb FROM files WHERE dir = ?', (rel_dir,)):
+        existing[row[0]] = tuple(row[1:])
+
+    with db:
+        removed = [(p,) for p in existing if p not in files]
+        db.executemany('DELETE FROM files WHERE path = ?', removed)
+
+        changed = [(p, rel_dir) + f for p, f in files.iteritems() if existing.get(p) != f]
+        db.executemany('INSERT OR REPLACE INTO files (path, dir, name, type, mtime, size, thumb) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', changed)
+
+        # subdirectories that have disappeared
+        for (path,) in db.execute("SELECT path FROM dirs WHERE parent = ? AND path != ''", (rel_dir,)).fetchall():
+            if path not in subdirs:
+                _forget_dir(db, path, commit=False)
+
+        parent = os.path.dirname(rel_dir) if rel_dir else None
+        mtime = dir_st.st_mtime if settled else None # None forces a rescan next time
+        db.execute('INSERT OR REPLACE INTO dirs (path, parent, mtime) VALUES (?, ?, ?)', (rel_dir, parent, mtime))
+
+    return subdirs
+
+
+def _forget_dir(db, rel_dir, commit=True):
+    prefix = rel_dir + '/'
+
+    def forget():
+        db.execute('DELETE FROM files WHERE dir = ? OR substr(dir, 1, length(?)) = ?', (rel_dir, prefix, prefix))
+        db.execute('DELETE FROM dirs WHERE path = ? OR substr(path, 1, length(?)) = ?', (rel_dir, prefix, prefix))
+
+    if commit:
+        with db:
+            forget()
+
+    else:
+        forget()
@@ -0,0 +1,464 @@
+
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import logging
+import multiprocessing
+import os
+import signal
+import struct
+import sys
+import threading
+
+from tornado.ioloop import IOLoop
+
+import config
+import mediaindex
+import settings
+import utils
+import workers
+
+
+_CHECK_INTERVAL = 10
+_FLUSH_INTERVAL = 1
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0x00080000
+
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE | _IN_ONLYDIR
+_EVENT_HEADER = struct.Struct('iIII')
+
+_libc = None
+_inotify_fd = None
+
+_watches = {} # (camera id, relative dir) indexed by watch descriptor
+_cameras = {} # {'target_dir', 'wds', 'current'} indexed by camera id
+
+# pending changes, indexed by camera id
+_pending_paths = {}
+_pending_dirs = {}
+_pending_removed_dirs = {}
+_flush_scheduled = False
+
+# the changes handed over to the workers, indexed by camera id; they are applied in order, under the lock
+# of the camera, by whichever worker comes first: the one submitted by flush() or one about to query the index
+_queued_changes = {}
+_apply_locks = {}
+_queue_lock = threading.Lock()
+
+_reconcile_process = None
+_reconcile_camera_ids = []
+_reconcile_pending = False # asked for while already running, to be run again once done
+
+
+def start():
+    global _libc
+    global _inotify_fd
+
+    io_loop = IOLoop.instance()
+
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = _libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    except Exception as e:
+        logging.error('failed to initialize inotify, media files will be discovered by scanning: %s' % e)
+
+    else:
+        _inotify_fd = fd
+        io_loop.add_handler(_inotify_fd, _on_inotify_events, IOLoop.READ)
+
+    io_loop.add_callback(_check_cameras)
+
+    if settings.MEDIA_INDEX_RECONCILE_INTERVAL:
+        io_loop.add_timeout(datetime.timedelta(seconds=settings.MEDIA_INDEX_RECONCILE_INTERVAL), _run_reconcile_periodically)
+
+
+def stop():
+    global _inotify_fd
+    global _reconcile_process
+
+    if _inotify_fd is not None:
+        IOLoop.instance().remove_handler(_inotify_fd)
+        os.close(_inotify_fd)
+        _inotify_fd = None
+
+    _watches.clear()
+    _cameras.clear()
+
+    if _reconcile_process and _reconcile_process.is_alive():
+        _reconcile_process.terminate()
+
+    _reconcile_process = None
+
+
+def is_current(camera_id):
+    # tells whether the media index of the given camera is kept up to date by
+    # file system events, so that no directory scanning is needed before querying it
+    camera = _cameras.get(camera_id)
+
+    return bool(camera and camera['current'])
+
+
+def notify(camera_config, full_path):
+    # called when a media file is known to have been created, changed or removed
+    camera_id = camera_config['@id']
+    _pending_paths.setdefault(camera_id, set()).add(full_path)
+    _schedule_flush()
+
+
+def flush(camera_id=None):
+    # hands the pending changes over to a worker, keeping the index (and its lock) away from the IO loop
+    if camera_id is None:
+        camera_ids = set(_pending_paths.keys() + _pending_dirs.keys() + _pending_removed_dirs.keys())
+
+    else:
+        camera_ids = [camera_id]
+
+    for camera_id in camera_ids:
+        paths = _pending_paths.pop(camera_id, None)
+        dirs = _pending_dirs.pop(camera_id, None)
+        removed_dirs = _pending_removed_dirs.pop(camera_id, None)
+        if not paths and not dirs and not removed_dirs:
+            continue
+
+        camera_config = config.get_camera(camera_id)
+        if not utils.is_local_motion_camera(camera_config):
+            continue
+
+        with _queue_lock:
+            _queued_changes.setdefault(camera_id, []).append(
+                    (camera_config, removed_dirs or [], paths or [], sorted(dirs or [])))
+
+        workers.submit(apply_changes, settings.LIST_MEDIA_TIMEOUT, camera_id)
+
+
+def apply_changes(camera_id):
+    # applies the changes queued by flush() for the given camera; this is called by worker threads,
+    # including those about to query the index, so that they see the changes flushed before them
+    with _queue_lock:
+        lock = _apply_locks.setdefault(camera_id, threading.Lock())
+
+    with lock:
+        with _queue_lock:
+            changes = _queued_changes.pop(camera_id, [])
+
+        for (camera_config, removed_dirs, paths, dirs) in changes:
+            try:
+                for rel_dir in removed_dirs:
+                    mediaindex.remove_dir(camera_config, rel_dir)
+
+                if paths:
+                    mediaindex.update(camera_config, paths)
+
+                if dirs:
+                    # files may have been added to these directories before they were watched
+                    mediaindex.sync_groups(camera_config, dirs)
+
+            except Exception as e:
+                logging.error('failed to update media index for camera %(id)s: %(msg)s' % {
+                        'id': camera_id, 'msg': unicode(e)}, exc_info=True)
+
+
+def _schedule_flush():
+    global _flush_scheduled
+
+    if _flush_scheduled:
+        return
+
+    def do_flush():
+        global _flush_scheduled
+
+        _flush_scheduled = False
+        flush()
+
+    _flush_scheduled = True
+    io_loop = IOLoop.instance()
+    io_loop.add_timeout(datetime.timedelta(seconds=_FLUSH_INTERVAL), do_flush)
+
+
+def _check_cameras():
+    io_loop = IOLoop.instance()
+    io_loop.add_timeout(datetime.timedelta(seconds=_CHECK_INTERVAL), _check_cameras)
+
+    target_dirs = {}
+    for camera_id in config.get_camera_ids():
+        camera_config = config.get_camera(camera_id)
+        if utils.is_local_motion_camera(camera_config) and camera_config.get('target_dir'):
+            target_dirs[camera_id] = camera_config['target_dir']
+
+    changed = False
+    for camera_id, camera in _cameras.items():
+        if target_dirs.get(camera_id) != camera['target_dir'] or not os.path.isdir(camera['target_dir']):
+            _unwatch_camera(camera_id)
+            changed = True
+
+    for camera_id, target_dir in target_dirs.iteritems():
+        if camera_id not in _cameras and os.path.isdir(target_dir):
+            _watch_camera(camera_id, target_dir)
+            changed = True
+
+    if changed:
+        _start_reconcile()
+
+
+def _watch_camera(camera_id, target_dir):
+    _cameras[camera_id] = {'target_dir': target_dir, 'wds': set(), 'current': False}
+    if _inotify_fd is None:
+        return
+
+    logging.debug('watching media files of camera %(id)s in %(path)s' % {'id': camera_id, 'path': target_dir})
+
+    # watch the directories already known to the index;
+    # the ones that are discovered by the reconcile process are added later
+    _add_watch(camera_id, '')
+    _watch_indexed_dirs(camera_id)
+
+
+def _watch_indexed_dirs(camera_id, rescan=False):
+    # the directories known to the index are read by a worker, and those not watched yet are watched here;
+    # with rescan, they are synced as well, since they may have changed before being watched,
+    # after which the index of the camera is considered current
+    camera = _cameras[camera_id]
+
+    def on_dirs(future):
+        if _cameras.get(camera_id) is not camera or _inotify_fd is None:
+            return # no longer watched
+
+        try:
+            rel_dirs = future.result()
+
+        except workers.TimeoutError:
+            logging.error('timeout waiting for the media index directories of camera %(id)s' % {'id': camera_id})
+            return
+
+        except Exception:
+            return # already logged by the worker
+
+        watched = set(_watches[wd][1] for wd in camera['wds'] if wd in _watches)
+        all_watched = True
+        for rel_dir in rel_dirs:
+            if rel_dir in watched:
+                continue
+
+            all_watched = _add_watch(camera_id, rel_dir) and all_watched
+            if rescan:
+                _pending_dirs.setdefault(camera_id, set()).add(rel_dir)
+
+        if rescan:
+            camera['current'] = all_watched
+            _schedule_flush()
+
+    future = workers.submit(mediaindex.list_dirs, settings.LIST_MEDIA_TIMEOUT, config.get_camera(camera_id))
+    IOLoop.instance().add_future(future, on_dirs)
+
+
+def _unwatch_camera(camera_id):
+    camera = _cameras.pop(camera_id)
+    logging.debug('no longer watching media files of camera %(id)s in %(path)s' % {
+            'id': camera_id, 'path': camera['target_dir']})
+
+    for wd in camera['wds']:
+        _watches.pop(wd, None)
+        if _inotify_fd is not None:
+            _libc.inotify_rm_watch(_inotify_fd, wd)
+
+
+def _add_watch(camera_id, rel_dir):
+    camera = _cameras[camera_id]
+    full_path = os.path.join(camera['target_dir'], rel_dir)
+
+    wd = _libc.inotify_add_watch(_inotify_fd, full_path, _WATCH_MASK)
+    if wd < 0:
+        err = ctypes.get_errno()
+        if err != errno.ENOENT: # could have been removed in the meantime
+            logging.error('failed to watch directory %(path)s: %(msg)s' % {
+                    'path': full_path, 'msg': os.strerror(err)})
+
+            # the index can't be kept up to date by events anymore
+            camera['current'] = False
+
+        return False
+
+    _watches[wd] = (camera_id, rel_dir)
+    camera['wds'].add(wd)
+
+    return True
+
+
+def _on_inotify_events(fd, events):
+    try:
+        data = os.read(_inotify_fd, 65536)
+
+    except OSError as e:
+        if e.errno != errno.EAGAIN:
+            logging.error('failed to read inotify events: %s' % e)
+
+        return
+
+    pos = 0
+    while pos < len(data):
+        wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)  # @UnusedVariable
+        pos += _EVENT_HEADER.size
+        name = data[pos:pos + length].rstrip('\0')
+        pos += length
+
+        if mask & _IN_Q_OVERFLOW:
+            logging.warning('inotify event queue overflowed, media index must be reconciled')
+            for camera in _cameras.itervalues():
+                camera['current'] = False
+
+            _start_reconcile()
+            continue
+
+        watch = _watches.get(wd)
+        if watch is None:
+            continue
+
+        camera_id, rel_dir = watch
+        camera = _cameras[camera_id]
+
+        if mask & _IN_IGNORED: # directory removed or unwatched
+            _watches.pop(wd, None)
+            camera['wds'].discard(wd)
+            continue
+
+        if not name or name.startswith('.'):
+            continue
+
+        rel_path = os.path.join(rel_dir, name)
+        if mask & _IN_ISDIR:
+            if mask & (_IN_CREATE | _IN_MOVED_TO):
+                # files may have been added before the watch was in place,
+                # so the new directory is scanned as well
+                _add_watch(camera_id, rel_path)
+                _pending_dirs.setdefault(camera_id, set()).add(rel_path)
+
+            elif mask & (_IN_DELETE | _IN_MOVED_FROM):
+                _pending_removed_dirs.setdefault(camera_id, set()).add(rel_path)
+
+        else:
+            _pending_paths.setdefault(camera_id, set()).add(os.path.join(camera['target_dir'], rel_path))
+
+    _schedule_flush()
+
+
+def _run_reconcile_periodically():
+    io_loop = IOLoop.instance()
+    io_loop.add_timeout(datetime.timedelta(seconds=settings.MEDIA_INDEX_RECONCILE_INTERVAL), _run_reconcile_periodically)
+
+    _start_reconcile()
+
+
+def _start_reconcile():
+    global _reconcile_process
+    global _reconcile_camera_ids
+    global _reconcile_pending
+
+    if _reconcile_process and _reconcile_process.is_alive():
+        _reconcile_pending = True # the cameras may have changed since it started
+        return
+
+    _reconcile_pending = False
+
+    logging.debug('running media index reconcile process...')
+
+    # the cameras that are watched at this point will have a current index
+    # once the reconcile process is done
+    _reconcile_camera_ids = _cameras.keys()
+    _reconcile_process = multiprocessing.Process(target=_do_reconcile, args=(_reconcile_camera_ids,))
+    _reconcile_process.start()
+
+    # poll the process more often than the cameras are checked
+    def poll_process():
+        if _reconcile_process is None:
+            return
+
+        if _reconcile_process.is_alive():
+            io_loop.add_timeout(datetime.timedelta(seconds=_FLUSH_INTERVAL), poll_process)
+
+        else:
+            _on_reconcile_finished()
+            if _reconcile_pending:
+                _start_reconcile()
+
+    io_loop = IOLoop.instance()
+    io_loop.add_timeout(datetime.timedelta(seconds=_FLUSH_INTERVAL), poll_process)
+
+
+def _on_reconcile_finished():
+    global _reconcile_process
+
+    if _reconcile_process.exitcode != 0:
+        logging.error('media index reconcile process failed')
+        _reconcile_process = None
+
+        return
+
+    _reconcile_process = None
+
+    if _inotify_fd is not None:
+        # watch the directories that have been discovered in the meantime; those that have changed since
+        # the reconcile process scanned them may have files it didn't see, so they are synced again
+        for camera_id in _reconcile_camera_ids:
+            if camera_id in _cameras:
+                _watch_indexed_dirs(camera_id, rescan=True)
+
+    logging.debug('media index reconcile process done')
+
+
+def _do_reconcile(camera_ids):
+    # this will be executed in a separate subprocess
+
+    # ignore the terminate and interrupt signals in this subprocess
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # this is a low-priority background job
+    os.nice(19)
+
+    failed = False
+    for camera_id in camera_ids:
+        camera_config = config.get_camera(camera_id)
+        if not utils.is_local_motion_camera(camera_config):
+            continue
+
+        try:
+            mediaindex.sync(camera_config)
+
+        except Exception as e:
+            logging.error('failed to reconcile media index for camera %(id)s: %(msg)s' % {
+                    'id': camera_id, 'msg': unicode(e)}, exc_info=True)
+
+            failed = True
+
+    if failed:
+        sys.exit(1)
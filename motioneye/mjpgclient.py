@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>. 
 
+import collections
 import datetime
 import errno
 import logging
@@ -22,6 +23,7 @@ import re
 import socket
 import time
 
+from tornado.concurrent import Future
 from tornado.ioloop import IOLoop
 from tornado.iostream import IOStream
 
@@ -35,7 +37,13 @@ class MjpgClient(IOStream):
     _FPS_LEN = 4
     
     clients = {} # dictionary of clients indexed by camera id
+    subscribers = {} # lists of frame callbacks indexed by camera id; they outlive the clients
+    history = {} # the recent frames of each camera, indexed by camera id; they outlive the clients as well
+    waiters = {} # lists of futures waiting for the next frame, indexed by camera id
     _last_erroneous_close_time = 0 # helps detecting erroneous connections and restart motion
+    # frame sequence numbers are shared by all clients, so that they never repeat;
+    # starting from the current time in milliseconds keeps them growing across restarts as well
+    _last_seq = int(time.time() * 1000)
 
     def __init__(self, camera_id, port, username, password, auth_mode):
         self._camera_id = camera_id
@@ -47,7 +55,10 @@ class MjpgClient(IOStream):
         
         self._last_access = None
         self._last_jpg = None
-        self._last_jpg_times = []
+        self._last_jpg_seq = None
+        self._last_jpg_times = collections.deque(maxlen=self._FPS_LEN)
+        self._boundary = None
+        self._boundary_read = False # the boundary of the next part has already been read with the previous frame
         
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
         IOStream.__init__(self, s)
@@ -65,6 +76,10 @@ class MjpgClient(IOStream):
             logging.debug('mjpg client for camera %(camera_id)s on port %(port)s removed' % {
                     'port': self._port, 'camera_id': self._camera_id})
 
+        # no frame is coming anymore from this client
+        for future in MjpgClient.waiters.pop(self._camera_id, []):
+            future.set_result((None, None))
+
         if getattr(self, 'error', None) and self.error.errno != errno.ECONNREFUSED:
             now = time.time()
             if now - MjpgClient._last_erroneous_close_time < settings.MJPG_CLIENT_TIMEOUT:
@@ -80,6 +95,9 @@ class MjpgClient(IOStream):
     def get_last_jpg(self):
         self._last_access = time.time()
         return self._last_jpg
+
+    def get_last_jpg_seq(self):
+        return self._last_jpg_seq
     
     def get_fps(self):
         if len(self._last_jpg_times) < self._FPS_LEN:
@@ -142,8 +160,8 @@ class MjpgClient(IOStream):
         if data.endswith('401 '):
             self._seek_www_authenticate()
 
-        else: # no authorization required, skip to content length
-            self._seek_content_length()
+        else: # no authorization required, skip to the multipart content
+            self._seek_headers()
 
     def _seek_www_authenticate(self):
         if self._check_error():
@@ -186,42 +204,116 @@ class MjpgClient(IOStream):
             return
 
         logging.error('mjpg client unknown authentication header: "%s"' % data)
-        self._seek_content_length()
+        self._seek_headers()
 
-    def _seek_content_length(self):
+    def _seek_headers(self):
         if self._check_error():
             return
-        
-        self.read_until('Content-Length:', self._on_before_content_length)
-    
-    def _on_before_content_length(self, data):
+
+        self.read_until('\r\n\r\n', self._on_headers)
+
+    def _on_headers(self, data):
         if self._check_error():
             return
-        
-        self.read_until('\r\n\r\n', self._on_content_length)
-    
-    def _on_content_length(self, data):
+
+        # the parts of the multipart stream are delimited by the boundary given in the content type
+        index = data.lower().find('boundary=')
+        if index >= 0:
+            self._boundary = data[index + 9:].split('\r\n', 1)[0].split(';', 1)[0].strip().strip('"')
+
+        else:
+            logging.warning('mjpg client for camera %(camera_id)s: no multipart boundary in response headers' % {
+                    'camera_id': self._camera_id})
+
+        self._seek_part()
+
+    def _seek_part(self):
         if self._check_error():
             return
-        
-        matches = re.findall('(\d+)', data)
-        if not matches:
-            self._error('could not find content length in mjpg header line "%(header)s"' % {
-                    'header': data})
-            
+
+        # reads the boundary line together with the headers of the part
+        self.read_until('\r\n\r\n', self._on_part_headers)
+
+    def _on_part_headers(self, data):
+        if self._check_error():
             return
-        
-        length = int(matches[0])
-        
-        self.read_bytes(length, self._on_jpg)
-    
+
+        if self._boundary and not self._boundary_read and data.find(self._boundary) < 0:
+            self._error('could not find boundary in mjpg part headers "%(header)s"' % {'header': data})
+
+            return
+
+        index = data.find('Content-Length:')
+        if index < 0:
+            index = data.lower().find('content-length:')
+
+        if index >= 0:
+            try:
+                length = int(data[index + 15:data.find('\r\n', index)])
+
+            except ValueError:
+                self._error('invalid content length in mjpg part headers "%(header)s"' % {'header': data})
+
+                return
+
+            # the whole frame in one go
+            self._boundary_read = False
+            self.read_bytes(length, self._on_jpg)
+
+        elif self._boundary:
+            # no length given, the frame ends where the next boundary begins
+            self.read_until('\r\n--' + self._boundary, self._on_delimited_jpg)
+
+        else:
+            self._error('could not find content length in mjpg part headers "%(header)s"' % {'header': data})
+
+    def _on_delimited_jpg(self, data):
+        self._boundary_read = True
+        self._on_jpg(data[:-len(self._boundary) - 4])
+
     def _on_jpg(self, data):
+        MjpgClient._last_seq += 1
         self._last_jpg = data
+        self._last_jpg_seq = MjpgClient._last_seq
         self._last_jpg_times.append(time.time())
-        while len(self._last_jpg_times) > self._FPS_LEN:
-            self._last_jpg_times.pop(0)
 
-        self._seek_content_length()
+        if settings.FRAME_HISTORY_DURATION:
+            self._record_frame(data)
+
+        waiters = MjpgClient.waiters.pop(self._camera_id, None)
+        if waiters:
+            self._last_access = self._last_jpg_times[-1]
+            for future in waiters:
+                future.set_result((data, self._last_jpg_seq))
+
+        subscribers = MjpgClient.subscribers.get(self._camera_id)
+        if subscribers:
+            self._last_access = self._last_jpg_times[-1] # streaming counts as access
+            for callback in list(subscribers):
+                try:
+                    callback(data, self._last_jpg_seq)
+
+                except Exception as e:
+                    logging.error('mjpg client subscriber for camera %(camera_id)s failed: %(msg)s' % {
+                            'camera_id': self._camera_id, 'msg': unicode(e)}, exc_info=True)
+
+        self._seek_part()
+
+    def _record_frame(self, data):
+        # the frames are kept as they are, so the history shares them with everything else holding them
+        history = MjpgClient.history.setdefault(self._camera_id, {'frames': collections.deque(), 'size': 0})
+        frames = history['frames']
+
+        now = self._last_jpg_times[-1]
+        frames.append((now, self._last_jpg_seq, data))
+        history['size'] += len(data)
+
+        max_size = settings.FRAME_HISTORY_MAX_SIZE * 1024 * 1024
+        while frames and (len(frames) > settings.FRAME_HISTORY_MAX_FRAMES or
+                          history['size'] > max_size or
+                          frames[0][0] < now - settings.FRAME_HISTORY_DURATION):
+
+            history['size'] -= len(frames.popleft()[2])
 
 
 def start():
@@ -231,6 +323,85 @@ def start():
 
 
 def get_jpg(camera_id):
+    client = _get_client(camera_id)
+    if client is None:
+        return None
+
+    return client.get_last_jpg()
+
+
+def get_frame(camera_id):
+    # returns the last frame along with its sequence number, which identifies it among all the frames
+    # of all cameras and grows with each new frame; (None, None) if no frame is available (yet)
+    client = _get_client(camera_id)
+    if client is None:
+        return (None, None)
+
+    jpg = client.get_last_jpg()
+    if jpg is None:
+        return (None, None)
+
+    return (jpg, client.get_last_jpg_seq())
+
+
+def get_history(camera_id, start=None, end=None):
+    # returns the recorded (time, seq, jpg) frames of the camera, oldest first,
+    # optionally limited to those received between start and end (timestamps)
+    history = MjpgClient.history.get(camera_id)
+    if not history:
+        return []
+
+    return [f for f in history['frames'] if (start is None or f[0] >= start) and (end is None or f[0] <= end)]
+
+
+def wait_frame(camera_id, timeout):
+    # returns a future resolved with the (jpg, seq) of the next frame of the camera as soon as it arrives,
+    # or with (None, None) if it doesn't arrive within timeout seconds or if the camera can't be streamed
+    future = Future()
+    if _get_client(camera_id) is None:
+        future.set_result((None, None))
+        return future
+
+    def on_timeout():
+        waiters = MjpgClient.waiters.get(camera_id, [])
+        if future in waiters:
+            waiters.remove(future)
+            if not waiters:
+                MjpgClient.waiters.pop(camera_id, None)
+
+            future.set_result((None, None))
+
+    io_loop = IOLoop.instance()
+    timeout = io_loop.add_timeout(datetime.timedelta(seconds=timeout), on_timeout)
+    future.add_done_callback(lambda f: io_loop.remove_timeout(timeout))
+
+    MjpgClient.waiters.setdefault(camera_id, []).append(future)
+
+    return future
+
+
+def subscribe(camera_id, callback):
+    # callback(jpg, seq) will be called with every frame received from the camera, until unsubscribed;
+    # returns False if the camera can't be streamed
+    client = _get_client(camera_id)
+    if client is None:
+        return False
+
+    MjpgClient.subscribers.setdefault(camera_id, []).append(callback)
+
+    return True
+
+
+def unsubscribe(camera_id, callback):
+    subscribers = MjpgClient.subscribers.get(camera_id, [])
+    if callback in subscribers:
+        subscribers.remove(callback)
+
+    if not subscribers:
+        MjpgClient.subscribers.pop(camera_id, None)
+
+
+def _get_client(camera_id):
     if camera_id not in MjpgClient.clients:
         # mjpg client not started yet for this camera
         
@@ -256,9 +427,7 @@ def get_jpg(camera_id):
         
         MjpgClient.clients[camera_id] = client
 
-    client = MjpgClient.clients[camera_id]
-
-    return client.get_last_jpg()
+    return MjpgClient.clients[camera_id]
 
 
 def get_fps(camera_id):
@@ -282,6 +451,26 @@ def _garbage_collector():
     io_loop = IOLoop.instance()
     io_loop.add_timeout(datetime.timedelta(seconds=settings.MJPG_CLIENT_TIMEOUT), _garbage_collector)
 
+    # clients closed while being streamed from are brought back
+    camera_ids = config.get_camera_ids()
+    for camera_id in MjpgClient.subscribers.keys():
+        if camera_id in camera_ids and camera_id not in MjpgClient.clients:
+            _get_client(camera_id)
+
+    # when recording the frame history, all the local cameras are kept connected
+    for camera_id in MjpgClient.history.keys():
+        if camera_id not in camera_ids:
+            MjpgClient.history.pop(camera_id)
+
+    if settings.FRAME_HISTORY_DURATION:
+        for camera_id in camera_ids:
+            if camera_id in MjpgClient.clients:
+                continue
+
+            camera_config = config.get_camera(camera_id)
+            if camera_config['@enabled'] and utils.is_local_motion_camera(camera_config):
+                _get_client(camera_id)
+
     now = time.time()
     for camera_id, client in MjpgClient.clients.items():
         port = client._port
@@ -311,7 +500,7 @@ def _garbage_collector():
             continue
 
         delta = now - client._last_access
-        if settings.MJPG_CLIENT_IDLE_TIMEOUT and delta > settings.MJPG_CLIENT_IDLE_TIMEOUT:
+        if settings.MJPG_CLIENT_IDLE_TIMEOUT and delta > settings.MJPG_CLIENT_IDLE_TIMEOUT and not settings.FRAME_HISTORY_DURATION:
             logging.debug('mjpg client for camera %(camera_id)s on port %(port)s has been idle for %(timeout)s seconds, removing it' % {
                     'camera_id': camera_id, 'port': port, 'timeout': settings.MJPG_CLIENT_IDLE_TIMEOUT})
 
@@ -339,7 +339,9 @@ def get_current_picture(local_config, width, height, callback):
     http_client.fetch(request, _callback_wrapper(on_response))
 
 
-def list_media(local_config, media_type, prefix, callback):
+def list_media(local_config, media_type, prefix, callback, since=None, until=None,
+        limit=None, cursor=None, order=None, format=None):
+
     scheme, host, port, username, password, path, camera_id = _remote_params(local_config)
     
     logging.debug('getting media list for remote camera %(id)s on %(url)s' % {
@@ -349,6 +351,24 @@ def list_media(local_config, media_type, prefix, callback):
     query = {}
     if prefix is not None:
         query['prefix'] = prefix
+
+    if since is not None:
+        query['since'] = repr(since)
+
+    if until is not None:
+        query['until'] = repr(until)
+
+    if limit is not None:
+        query['limit'] = str(limit)
+
+    if cursor:
+        query['cursor'] = cursor
+
+    if order:
+        query['order'] = order
+
+    if format:
+        query['format'] = format
     
     # timeout here is 10 times larger than usual - we expect a big delay when fetching the media list
     request = _make_request(scheme, host, port, username, password,
@@ -381,6 +401,84 @@ def list_media(local_config, media_type, prefix, callback):
     http_client.fetch(request, _callback_wrapper(on_response))
 
 
+def list_groups(local_config, media_type, callback):
+    scheme, host, port, username, password, path, camera_id = _remote_params(local_config)
+    
+    logging.debug('getting media groups for remote camera %(id)s on %(url)s' % {
+            'id': camera_id,
+            'url': pretty_camera_url(local_config)})
+    
+    # timeout here is 10 times larger than usual - we expect a big delay when fetching the media list
+    request = _make_request(scheme, host, port, username, password,
+            path + '/%(media_type)s/%(id)s/groups/' % {
+            'id': camera_id, 'media_type': media_type},
+            timeout=10 * settings.REMOTE_REQUEST_TIMEOUT)
+    
+    def on_response(response):
+        if response.error:
+            logging.error('failed to get media groups for remote camera %(id)s on %(url)s: %(msg)s' % {
+                    'id': camera_id,
+                    'url': pretty_camera_url(local_config),
+                    'msg': utils.pretty_http_error(response)})
+            
+            return callback(error=utils.pretty_http_error(response))
+        
+        try:
+            response = json.loads(response.body)
+            
+        except Exception as e:
+            logging.error('failed to decode json answer from %(url)s: %(msg)s' % {
+                    'url': pretty_camera_url(local_config),
+                    'msg': unicode(e)})
+            
+            return callback(error=unicode(e))
+        
+        return callback(response)
+    
+    http_client = AsyncHTTPClient()
+    http_client.fetch(request, _callback_wrapper(on_response))
+
+
+def get_media_usage(local_config, callback):
+    scheme, host, port, username, password, path, camera_id = _remote_params(local_config)
+    
+    logging.debug('getting media usage for remote camera %(id)s on %(url)s' % {
+            'id': camera_id,
+            'url': pretty_camera_url(local_config)})
+    
+    # timeout here is 10 times larger than usual - we expect a big delay when fetching the media list
+    request = _make_request(scheme, host, port, username, password,
+            path + '/config/%(id)s/usage/' % {'id': camera_id},
+            timeout=10 * settings.REMOTE_REQUEST_TIMEOUT)
+    
+    def on_response(response):
+        if response.error:
+            logging.error('failed to get media usage for remote camera %(id)s on %(url)s: %(msg)s' % {
+                    'id': camera_id,
+                    'url': pretty_camera_url(local_config),
+                    'msg': utils.pretty_http_error(response)})
+            
+            return callback(error=utils.pretty_http_error(response))
+        
+        try:
+            response = json.loads(response.body)
+            
+        except Exception as e:
+            logging.error('failed to decode json answer from %(url)s: %(msg)s' % {
+                    'url': pretty_camera_url(local_config),
+                    'msg': unicode(e)})
+            
+            return callback(error=unicode(e))
+        
+        if response.get('error'):
+            return callback(error=response['error'])
+
+        return callback(response.get('usage'))
+    
+    http_client = AsyncHTTPClient()
+    http_client.fetch(request, _callback_wrapper(on_response))
+
+
 def get_media_content(local_config, filename, media_type, callback):
     scheme, host, port, username, password, path, camera_id = _remote_params(local_config)
     
@@ -681,7 +779,8 @@ def del_media_content(local_config, filename, media_type, callback):
     http_client.fetch(request, _callback_wrapper(on_response))
 
 
-def del_media_group(local_config, group, media_type, callback):
+def del_media_group(local_config, group, media_type, callback, background=False):
+    # with background, the remote motionEye answers right away with the status of its deletion job
     scheme, host, port, username, password, path, camera_id = _remote_params(local_config)
     
     logging.debug('deleting group "%(group)s" of remote camera %(id)s on %(url)s' % {
@@ -694,6 +793,9 @@ def del_media_group(local_config, group, media_type, callback):
             'id': camera_id,
             'group': group}
 
+    if background:
+        path += '?background=true'
+
     request = _make_request(scheme, host, port, username, password, path,
             method='POST', data='{}',
             timeout=settings.REMOTE_REQUEST_TIMEOUT, content_type='application/json')
@@ -708,7 +810,153 @@ def del_media_group(local_config, group, media_type, callback):
             
             return callback(error=utils.pretty_http_error(response))
         
-        callback()
+        if not background:
+            return callback()
+
+        try:
+            response = json.loads(response.body)
+
+        except Exception as e:
+            logging.error('failed to decode json answer from %(url)s: %(msg)s' % {
+                    'url': pretty_camera_url(local_config),
+                    'msg': unicode(e)})
+
+            return callback(error=unicode(e))
+
+        callback(response)
+
+    http_client = AsyncHTTPClient()
+    http_client.fetch(request, _callback_wrapper(on_response))
+
+
+def del_media_files(local_config, media_type, paths, since, until, callback):
+    scheme, host, port, username, password, path, camera_id = _remote_params(local_config)
+
+    logging.debug('deleting %(media_type)ss of remote camera %(id)s on %(url)s' % {
+            'media_type': media_type,
+            'id': camera_id,
+            'url': pretty_camera_url(local_config)})
+
+    path += '/%(media_type)s/%(id)s/delete_many/' % {
+            'media_type': media_type,
+            'id': camera_id}
+
+    data = {}
+    if paths is not None:
+        data['paths'] = paths
+
+    if since is not None:
+        data['since'] = since
+
+    if until is not None:
+        data['until'] = until
+
+    request = _make_request(scheme, host, port, username, password, path,
+            method='POST', data=json.dumps(data),
+            timeout=settings.REMOTE_REQUEST_TIMEOUT, content_type='application/json')
+
+    def on_response(response):
+        if response.error:
+            logging.error('failed to delete %(media_type)ss of remote camera %(id)s on %(url)s: %(msg)s' % {
+                    'media_type': media_type,
+                    'id': camera_id,
+                    'url': pretty_camera_url(local_config),
+                    'msg': utils.pretty_http_error(response)})
+
+            return callback(error=utils.pretty_http_error(response))
+
+        try:
+            response = json.loads(response.body)
+
+        except Exception as e:
+            logging.error('failed to decode json answer from %(url)s: %(msg)s' % {
+                    'url': pretty_camera_url(local_config),
+                    'msg': unicode(e)})
+
+            return callback(error=unicode(e))
+
+        callback(response)
+
+    http_client = AsyncHTTPClient()
+    http_client.fetch(request, _callback_wrapper(on_response))
+
+
+def check_media_group_deletion(local_config, group, media_type, job_id, callback):
+    scheme, host, port, username, password, path, camera_id = _remote_params(local_config)
+
+    logging.debug('checking group deletion status for remote camera %(id)s on %(url)s' % {
+            'id': camera_id,
+            'url': pretty_camera_url(local_config)})
+
+    request = _make_request(scheme, host, port, username, password,
+            path + '/%(media_type)s/%(id)s/delete_all/%(group)s/?job=%(job)s' % {
+                    'media_type': media_type,
+                    'id': camera_id,
+                    'group': group,
+                    'job': job_id})
+
+    def on_response(response):
+        if response.error:
+            logging.error('failed to check group deletion status for remote camera %(id)s on %(url)s: %(msg)s' % {
+                    'id': camera_id,
+                    'url': pretty_camera_url(local_config),
+                    'msg': utils.pretty_http_error(response)})
+
+            return callback(error=utils.pretty_http_error(response))
+
+        try:
+            response = json.loads(response.body)
+
+        except Exception as e:
+            logging.error('failed to decode json answer from %(url)s: %(msg)s' % {
+                    'url': pretty_camera_url(local_config),
+                    'msg': unicode(e)})
+
+            return callback(error=unicode(e))
+
+        callback(response)
+
+    http_client = AsyncHTTPClient()
+    http_client.fetch(request, _callback_wrapper(on_response))
+
+
+def cancel_media_group_deletion(local_config, group, media_type, job_id, callback):
+    scheme, host, port, username, password, path, camera_id = _remote_params(local_config)
+
+    logging.debug('cancelling group deletion for remote camera %(id)s on %(url)s' % {
+            'id': camera_id,
+            'url': pretty_camera_url(local_config)})
+
+    path += '/%(media_type)s/%(id)s/delete_all/%(group)s/?job=%(job)s&cancel=true' % {
+            'media_type': media_type,
+            'id': camera_id,
+            'group': group,
+            'job': job_id}
+
+    request = _make_request(scheme, host, port, username, password, path,
+            method='POST', data='{}',
+            timeout=settings.REMOTE_REQUEST_TIMEOUT, content_type='application/json')
+
+    def on_response(response):
+        if response.error:
+            logging.error('failed to cancel group deletion for remote camera %(id)s on %(url)s: %(msg)s' % {
+                    'id': camera_id,
+                    'url': pretty_camera_url(local_config),
+                    'msg': utils.pretty_http_error(response)})
+
+            return callback(error=utils.pretty_http_error(response))
+
+        try:
+            response = json.loads(response.body)
+
+        except Exception as e:
+            logging.error('failed to decode json answer from %(url)s: %(msg)s' % {
+                    'url': pretty_camera_url(local_config),
+                    'msg': unicode(e)})
+
+            return callback(error=unicode(e))
+
+        callback(response)
 
     http_client = AsyncHTTPClient()
     http_client.fetch(request, _callback_wrapper(on_response))
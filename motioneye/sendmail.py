@@ -128,7 +128,11 @@ def make_message(subject, message, camera_id, moment, timespan, callback):
     time.sleep(timespan) # give motion some time to create motion pictures
     
     logging.debug('creating email message')
-    mediafiles.list_media(camera_config, media_type='picture', callback=on_media_files)
+
+    # only query the pictures taken around the moment of the event
+    timestamp = time.mktime(moment.timetuple())
+    mediafiles.list_media(camera_config, media_type='picture', callback=on_media_files,
+            since=timestamp - timespan, until=timestamp + timespan)
     
     io_loop.start()
 
@@ -169,14 +169,16 @@ handler_mapping = [
     (r'^/$', handlers.MainHandler),
     (r'^/manifest.json$', handlers.ManifestHandler),
     (r'^/config/main/(?P<op>set|get)/?$', handlers.ConfigHandler),
-    (r'^/config/(?P<camera_id>\d+)/(?P<op>get|set|rem|set_preview|test|authorize)/?$', handlers.ConfigHandler),
-    (r'^/config/(?P<op>add|list|backup|restore)/?$', handlers.ConfigHandler),
-    (r'^/picture/(?P<camera_id>\d+)/(?P<op>current|list|frame)/?$', handlers.PictureHandler),
+    (r'^/config/(?P<camera_id>\d+)/(?P<op>get|set|rem|set_preview|test|authorize|usage)/?$', handlers.ConfigHandler),
+    (r'^/config/(?P<op>add|list|backup|restore|usage)/?$', handlers.ConfigHandler),
+    (r'^/picture/(?P<camera_id>\d+)/(?P<op>current|list|groups|frame|stream|history|delete_many)/?$', handlers.PictureHandler),
+    (r'^/picture/(?P<op>mosaic)/?$', handlers.PictureHandler),
     (r'^/picture/(?P<camera_id>\d+)/(?P<op>download|preview|delete)/(?P<filename>.+?)/?$', handlers.PictureHandler),
     (r'^/picture/(?P<camera_id>\d+)/(?P<op>zipped|timelapse|delete_all)/(?P<group>.*?)/?$', handlers.PictureHandler),
-    (r'^/movie/(?P<camera_id>\d+)/(?P<op>list)/?$', handlers.MovieHandler),
+    (r'^/movie/(?P<camera_id>\d+)/(?P<op>list|groups|delete_many)/?$', handlers.MovieHandler),
     (r'^/movie/(?P<camera_id>\d+)/(?P<op>download|preview|delete)/(?P<filename>.+?)/?$', handlers.MovieHandler),
     (r'^/movie/(?P<camera_id>\d+)/(?P<op>delete_all)/(?P<group>.*?)/?$', handlers.MovieHandler),
+    (r'^/frames/?$', handlers.FrameSocketHandler),
     (r'^/action/(?P<camera_id>\d+)/(?P<action>\w+)/?$', handlers.ActionHandler),
     (r'^/prefs/(?P<key>\w+)?/?$', handlers.PrefsHandler),
     (r'^/_relay_event/?$', handlers.RelayEventHandler),
@@ -346,11 +348,13 @@ def parse_options(parser, args):
 
 def run():
     import cleanup
+    import mediawatch
     import mjpgclient
     import motionctl
     import motioneye
     import smbctl
     import tasks
+    import workers
     import wsswitch
 
     configure_signals()
@@ -374,9 +378,15 @@ def run():
     wsswitch.start()
     logging.info('wsswitch started')
 
+    mediawatch.start()
+    logging.info('media watcher started')
+
     tasks.start()
     logging.info('tasks started')
 
+    workers.start()
+    logging.info('workers started')
+
     if settings.MJPG_CLIENT_TIMEOUT:
         mjpgclient.start()
         logging.info('mjpg client garbage collector started')
@@ -401,6 +411,12 @@ def run():
     tasks.stop()
     logging.info('tasks stopped')
 
+    workers.stop()
+    logging.info('workers stopped')
+
+    mediawatch.stop()
+    logging.info('media watcher stopped')
+
     if cleanup.running():
         cleanup.stop()
         logging.info('cleanup stopped')
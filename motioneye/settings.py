@@ -73,6 +73,24 @@ MOUNT_CHECK_INTERVAL = 300
 # to remove old pictures and movies
 CLEANUP_INTERVAL = 43200
 
+# the maximum number of storage devices cleaned up at the same time by the janitor
+CLEANUP_CONCURRENCY = 2
+
+# the maximum number of media files removed per second by the janitor (0 means no limit)
+CLEANUP_RATE_LIMIT = 0
+
+# the maximum total size in megabytes of the pictures and movies of all cameras;
+# the oldest files are removed by the janitor when it is exceeded (0 means no limit)
+MAX_MEDIA_SIZE = 0
+
+# the janitor is called early, removing the oldest pictures and movies, whenever the free
+# space on the disk of a camera falls below this number of megabytes (0 disables this)
+MIN_FREE_SPACE = 0
+
+# interval in seconds at which the media index is reconciled with the files on disk
+# (changes are normally picked up as they happen; set to 0 to disable)
+MEDIA_INDEX_RECONCILE_INTERVAL = 86400
+
 # timeout in seconds to wait for response from a remote motionEye server
 REMOTE_REQUEST_TIMEOUT = 10
 
@@ -83,6 +101,25 @@ MJPG_CLIENT_TIMEOUT = 10
 # (set to 0 to disable)
 MJPG_CLIENT_IDLE_TIMEOUT = 10
 
+# the maximum number of frames per second of each camera sent to a single viewer (a user at a given address,
+# across all of its connections; 0 disables this); requests of motionEye hubs are limited by the hubs themselves
+MAX_VIEWER_FRAME_RATE = 30
+
+# the resampling quality used when resizing pictures and frames on the server side
+# (fast, normal or best; fast is much lighter on slow CPUs)
+RESIZE_QUALITY = 'normal'
+
+# the number of seconds of recent frames kept in memory for each local camera,
+# so that they can be reviewed after an event (0 disables this);
+# enabling it keeps all the cameras streaming to motionEye all the time
+FRAME_HISTORY_DURATION = 0
+
+# the maximum number of megabytes of recent frames kept in memory for each camera
+FRAME_HISTORY_MAX_SIZE = 32
+
+# the maximum number of recent frames kept in memory for each camera
+FRAME_HISTORY_MAX_FRAMES = 300
+
 # enable SMB shares (requires motionEye to run as root) 
 SMB_SHARES = False
 
@@ -119,6 +156,18 @@ ZIP_TIMEOUT = 500
 # timeout in seconds to wait for timelapse creation
 TIMELAPSE_TIMEOUT = 500
 
+# timeout in seconds to wait for a group of media files to be deleted
+DELETE_MEDIA_TIMEOUT = 3600
+
+# the number of threads used for listing, zipping and other media file jobs the UI waits for;
+# a job that times out can't be stopped and keeps its thread busy until it ends,
+# so use more threads if slow disks often make listings time out (each thread costs some memory)
+WORKER_THREADS = 2
+
+# the number of threads used for long running background jobs, such as deleting groups of media files;
+# these jobs wait for each other, but never hold up the threads above
+BACKGROUND_WORKER_THREADS = 1
+
 # enable adding and removing cameras from UI
 ADD_REMOVE_CAMERAS = True
 
@@ -20,6 +20,9 @@ var overlayVisible = false;
 var layoutColumns = 1;
 var fitFramesVertically = false;
 var layoutRows = 1;
+var frameSocket = null; /* the websocket through which camera frames and status are received, when available */
+var frameSocketSubscription = null; /* the last subscription sent through the frame socket, as JSON */
+var frameSocketStatus = {}; /* dictionary indexed by cameraId, holds the status received through the frame socket */
 
 
     /* Object utilities */
@@ -295,6 +298,35 @@ var sha1 = (function () {
     return hash;
 }());
 
+var MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June',
+                   'July', 'August', 'September', 'October', 'November', 'December'];
+
+function prettyDateTime(timestamp, utcOffset, short) {
+    /* formats a timestamp in the local time of the server, like utils.pretty_date_time() does */
+    var date = new Date((timestamp + utcOffset) * 1000);
+    var hm = ('0' + date.getUTCHours()).slice(-2) + ':' + ('0' + date.getUTCMinutes()).slice(-2);
+    var month = MONTH_NAMES[date.getUTCMonth()];
+    
+    if (short) {
+        return date.getUTCDate() + ' ' + month.substring(0, 3) + ', ' + hm;
+    }
+    else {
+        return date.getUTCDate() + ' ' + month + ' ' + date.getUTCFullYear() + ', ' + hm;
+    }
+}
+
+function prettySize(size) {
+    /* formats a size in bytes, like utils.pretty_size() does */
+    var units = ['B', 'kB', 'MB', 'GB'];
+    var i = 0;
+    while (size >= 1024 && i < units.length - 1) {
+        size /= 1024;
+        i++;
+    }
+    
+    return size.toFixed(1) + ' ' + units[i];
+}
+
 function splitUrl(url) {
     if (!url) {
         url = window.location.href;
@@ -1821,6 +1853,7 @@ function cameraUi2Dict() {
         'network_username': $('#networkUsernameEntry').val(),
         'network_password': $('#networkPasswordEntry').val(),
         'root_directory': $('#rootDirectoryEntry').val(),
+        'max_media_size': $('#maxMediaSizeEntry').val(),
         'upload_enabled': $('#uploadEnabledSwitch')[0].checked,
         'upload_picture': $('#uploadPictureSwitch')[0].checked,
         'upload_movie': $('#uploadMovieSwitch')[0].checked,
@@ -2132,6 +2165,16 @@ function dict2CameraUi(dict) {
         this.setText((dict['disk_used'] / 1073741824).toFixed(1)  + '/' + (dict['disk_total'] / 1073741824).toFixed(1) + ' GB (' + percent + '%)');
     }); markHideIfNull('disk_used', 'diskUsageProgressBar');
     
+    var mediaUsage = dict['media_usage'];
+    if (mediaUsage) {
+        var pictureUsage = mediaUsage['picture'] || {count: 0, size: 0};
+        var movieUsage = mediaUsage['movie'] || {count: 0, size: 0};
+        $('#mediaUsageEntry').val(prettySize(pictureUsage.size) + ' in ' + pictureUsage.count + ' pictures, ' +
+                prettySize(movieUsage.size) + ' in ' + movieUsage.count + ' movies');
+    }
+    markHideIfNull('media_usage', 'mediaUsageEntry');
+    $('#maxMediaSizeEntry').val(dict['max_media_size']); markHideIfNull('max_media_size', 'maxMediaSizeEntry');
+    
     $('#uploadEnabledSwitch')[0].checked = dict['upload_enabled']; markHideIfNull('upload_enabled', 'uploadEnabledSwitch');
     $('#uploadPictureSwitch')[0].checked = dict['upload_picture']; markHideIfNull('upload_picture', 'uploadPictureSwitch');
     $('#uploadMovieSwitch')[0].checked = dict['upload_movie']; markHideIfNull('upload_movie', 'uploadMovieSwitch');
@@ -2970,7 +3013,7 @@ function doDeleteFile(path, callback) {
     }, {stack: true});
 }
 
-function doDeleteAllFiles(mediaType, cameraId, groupKey, callback) {
+function doDeleteAllFiles(mediaType, cameraId, groupKey, callback, cancelCallback) {
     var msg;
     if (groupKey) {
         if (mediaType == 'picture') {
@@ -2990,24 +3033,69 @@ function doDeleteAllFiles(mediaType, cameraId, groupKey, callback) {
     }
     
     runConfirmDialog(msg, function () {
-        showModalDialog('<div class="modal-progress"></div>', null, null, true);
-        if (groupKey) {
-            groupKey += '/';
-        }
-        ajax('POST', basePath + mediaType + '/' + cameraId + '/delete_all/' + groupKey, null, function (data) {
+        var progressBar = $('<div style=""></div>');
+        makeProgressBar(progressBar);
+
+        var url = basePath + mediaType + '/' + cameraId + '/delete_all/' + (groupKey ? groupKey + '/' : '');
+        var jobId = null;
+        var cancelled = false;
+
+        runModalDialog({
+            title: 'Deleting Files...',
+            content: progressBar,
+            stack: true,
+            noKeys: true,
+            buttons: [{caption: 'Cancel', isCancel: true, click: function () {
+                if (jobId && !cancelled) {
+                    cancelled = true;
+                    ajax('POST', url + '?job=' + jobId + '&cancel=true', null, function () {});
+                }
+
+                return false; /* the progress dialog is closed once the job acknowledges */
+            }}]
+        });
+
+        function finish(data) {
             hideModalDialog(); /* progress */
             hideModalDialog(); /* confirm */
-            
+
             if (data == null || data.error) {
                 showErrorMessage(data && data.error);
                 return;
             }
 
+            if (data.cancelled) {
+                showPopupMessage('Deleting files was cancelled.');
+
+                /* some of the files are left */
+                if (cancelCallback) {
+                    cancelCallback();
+                }
+
+                return;
+            }
+
             if (callback) {
                 callback();
             }
-        });
-        
+        }
+
+        function checkDeletion(data) {
+            if (data == null || data.error || data.done) {
+                return finish(data);
+            }
+
+            jobId = data.jobId;
+            progressBar[0].setProgress(data.progress * 100);
+            progressBar[0].setText(parseInt(data.progress * 100) + '%');
+
+            setTimeout(function () {
+                ajax('GET', url, {job: jobId}, checkDeletion);
+            }, 1000);
+        }
+
+        ajax('POST', url + '?background=true', null, checkDeletion);
+
         return false;
     }, {stack: true});
 }
@@ -3841,7 +3929,7 @@ function runAddCameraDialog() {
     updateUi();
 }
 
-function runTimelapseDialog(cameraId, groupKey, group) {
+function runTimelapseDialog(cameraId, groupKey, groupCount) {
     var content = 
             $('<table class="timelapse-dialog">' +
                 '<tr><td colspan="2" class="timelapse-warning"></td></tr>' +
@@ -3877,7 +3965,7 @@ function runTimelapseDialog(cameraId, groupKey, group) {
     var framerateSlider = content.find('#framerateSlider');
     var timelapseWarning = content.find('td.timelapse-warning');
     
-    if (group.length > 1440) { /* one day worth of pictures, taken 1 minute apart */
+    if (groupCount > 1440) { /* one day worth of pictures, taken 1 minute apart */
         timelapseWarning.html('Given the large number of pictures, creating your timelapse might take a while!');
         timelapseWarning.css('display', 'table-cell');
     }
@@ -3978,6 +4066,7 @@ function runMediaDialog(cameraId, mediaType) {
     var buttonsDiv = $('<div class="media-dialog-buttons"></div>');
     
     var groups = {};
+    var groupInfos = {};
     var groupKey = null;
     
     dialogDiv.append(groupsDiv);
@@ -4008,7 +4097,6 @@ function runMediaDialog(cameraId, mediaType) {
             }
         });
         
-        var mediaListByName = {};
         var entries = groups[key];
         
         /* cleanup the media list */
@@ -4053,6 +4141,7 @@ function runMediaDialog(cameraId, mediaType) {
                             var pos = entries.indexOf(entry);
                             if (pos >= 0) {
                                 entries.splice(pos, 1); /* remove entry from group */
+                                groupInfos[groupKey].count = entries.length;
                             }
 
                             /* update text on group button */
@@ -4095,15 +4184,15 @@ function runMediaDialog(cameraId, mediaType) {
             mediaListDiv.scroll();
         }
         
-        /* if details are already fetched, simply add the entries and return */
-        if (entries[0].timestamp) {
+        /* if entries are already fetched, simply add them and return */
+        if (groupInfos[key].loaded) {
             return addEntries();
         }
         
         var previewImg = $('<img class="media-list-progress" src="' + staticPath + 'img/modal-progress.gif"/>');
         mediaListDiv.append(previewImg);
         
-        var url = basePath + mediaType + '/' + cameraId + '/list/?prefix=' + (key || 'ungrouped');
+        var url = basePath + mediaType + '/' + cameraId + '/list/?prefix=' + (key || 'ungrouped') + '&format=compact';
         ajax('GET', url, null, function (data) {
             previewImg.remove();
             
@@ -4113,28 +4202,46 @@ function runMediaDialog(cameraId, mediaType) {
                 return;
             }
             
-            /* index the media list by name */
-            data.mediaList.forEach(function (media) {
+            if (data.format == 'compact') {
+                /* the details are formatted here, rather than by the server */
+                data.names.forEach(function (name, i) {
+                    var group = data.groups[data.groupIndexes[i]];
+                    var timestamp = data.timestamps[i];
+                    var utcOffset = typeof data.utcOffset == 'number' ? data.utcOffset : data.utcOffset[i];
+                    
+                    entries.push({
+                        'path': (group ? '/' + group : '') + '/' + name,
+                        'group': key,
+                        'name': name,
+                        'cameraId': cameraId,
+                        'momentStr': prettyDateTime(timestamp, utcOffset),
+                        'momentStrShort': prettyDateTime(timestamp, utcOffset, true),
+                        'sizeStr': prettySize(data.sizes[i]),
+                        'timestamp': timestamp
+                    });
+                });
+            }
+            
+            /* older remote servers ignore the format and send the full media list */
+            (data.mediaList || []).forEach(function (media) {
                 var path = media.path;
                 var parts = path.split('/');
-                var name = parts[parts.length - 1];
                 
-                mediaListByName[name] = media;
+                entries.push({
+                    'path': path,
+                    'group': key,
+                    'name': parts[parts.length - 1],
+                    'cameraId': cameraId,
+                    'momentStr': media.momentStr,
+                    'momentStrShort': media.momentStrShort,
+                    'sizeStr': media.sizeStr,
+                    'timestamp': media.timestamp
+                });
             });
             
-            /* assign details to entries */
-                entries.forEach(function (entry) {
-                    var media = mediaListByName[entry.name];
-                    if (media) {
-                        entry.momentStr = media.momentStr;
-                        entry.momentStrShort = media.momentStrShort;
-                        entry.sizeStr = media.sizeStr;
-                        entry.timestamp = media.timestamp;
-                    }
-                });
- 
-                /* sort the entries by timestamp */
+            /* sort the entries by timestamp */
             entries.sortKey(function (e) {return e.timestamp || e.name;}, true);
+            groupInfos[key].loaded = true;
             
             addEntries();
         });
@@ -4155,7 +4262,7 @@ function runMediaDialog(cameraId, mediaType) {
         
         timelapseButton.click(function () {
             if (groupKey != null) {
-                runTimelapseDialog(cameraId, groupKey, groups[groupKey]);
+                runTimelapseDialog(cameraId, groupKey, groupInfos[groupKey].count);
             }
         });
     }
@@ -4177,6 +4284,7 @@ function runMediaDialog(cameraId, mediaType) {
                     
                     /* delete the group itself */
                     delete groups[groupKey];
+                    delete groupInfos[groupKey];
                     
                     /* show the first existing group, if any */
                     var keys = Object.keys(groups);
@@ -4186,6 +4294,11 @@ function runMediaDialog(cameraId, mediaType) {
                     else {
                         hideModalDialog();
                     }
+                }, function () {
+                    /* reload the files that are left in the group */
+                    groups[groupKey] = [];
+                    groupInfos[groupKey].loaded = false;
+                    showGroup(groupKey);
                 });
             }
         });
@@ -4235,33 +4348,18 @@ function runMediaDialog(cameraId, mediaType) {
     
     showModalDialog('<div class="modal-progress"></div>');
     
-    /* fetch the media list */
-    ajax('GET', basePath + mediaType + '/' + cameraId + '/list/', null, function (data) {
+    /* fetch the media groups */
+    ajax('GET', basePath + mediaType + '/' + cameraId + '/groups/', null, function (data) {
         if (data == null || data.error) {
             hideModalDialog();
             showErrorMessage(data && data.error);
             return;
         }
         
-        /* group the media */
-        data.mediaList.forEach(function (media) {
-            var path = media.path;
-            var parts = path.split('/');
-            var keyParts = parts.splice(0, parts.length - 1);
-            var key = keyParts.join('/');
-            
-            if (key.indexOf('/') === 0) {
-                key = key.substring(1);
-            }
-            
-            var list = (groups[key] = groups[key] || []);
-            
-            list.push({
-                'path': path,
-                'group': key,
-                'name': parts[parts.length - 1],
-                'cameraId': cameraId
-            });
+        /* the group entries are fetched when the group is first shown */
+        data.groups.forEach(function (group) {
+            groups[group.key] = [];
+            groupInfos[group.key] = group;
         });
         
         updateDialogSize();
@@ -4273,7 +4371,7 @@ function runMediaDialog(cameraId, mediaType) {
         if (keys.length) {
             keys.forEach(function (key) {
                 var groupButton = $('<div class="media-dialog-group-button"></div>');
-                groupButton.text((key || '(ungrouped)') + ' (' + groups[key].length + ')');
+                groupButton.text((key || '(ungrouped)') + ' (' + groupInfos[key].count + ')');
                 groupButton[0].key = key;
                 
                 groupButton.click(function () {
@@ -4640,7 +4738,7 @@ function addCameraFrameUi(cameraConfig) {
         /* there's no point in looking for a cookie update more often than once every second */
         var now = new Date().getTime();
         if ((!this.lastCookieTime || now - this.lastCookieTime > 1000) && (cameraFrameDiv[0].config['proto'] != 'mjpeg')) {
-            if (getCookie('motion_detected_' + cameraId) == 'true') {
+            if (getCameraStatus(cameraId, 'motion_detected') == 'true') {
                 cameraFrameDiv.addClass('motion-detected');
             }
             else {
@@ -4654,8 +4752,8 @@ function addCameraFrameUi(cameraConfig) {
                 recordButton.removeClass('record-stop').addClass('record-start');
             }
             
-            var captureFps = getCookie('capture_fps_' + cameraId);
-            var monitorInfo = getCookie('monitor_info_' + cameraId);
+            var captureFps = getCameraStatus(cameraId, 'capture_fps');
+            var monitorInfo = getCameraStatus(cameraId, 'monitor_info');
             
             this.lastCookieTime = now;
 
@@ -4927,7 +5025,10 @@ function refreshCameraFrames() {
         cameraFrames = getCameraFrames();
     }
     
+    var subscription = {};
     cameraFrames.each(function () {
+        var cameraId = this.id.substring(6);
+        
         if (!this.img) {
             this.img = $(this).find('img.camera')[0];
             if (this.config['proto'] == 'mjpeg') {
@@ -4941,8 +5042,23 @@ function refreshCameraFrames() {
             return; /* no manual refresh for simple mjpeg cameras */
         }
         
-        var count = parseInt(1000 / (refreshInterval * this.config['streaming_framerate']));
         var serverSideResize = this.config['streaming_server_resize'];
+        if (frameSocket && !(frameSocketStatus[cameraId] && frameSocketStatus[cameraId].error)) {
+            /* frames are pushed through the frame socket */
+            var width = null;
+            if (resolutionFactor != 1) {
+                width = resolutionFactor;
+            }
+            else if (serverSideResize) {
+                width = this.img.width;
+            }
+            
+            subscription[cameraId] = {fps: this.config['streaming_framerate'] * framerateFactor, width: width};
+            
+            return;
+        }
+        
+        var count = parseInt(1000 / (refreshInterval * this.config['streaming_framerate']));
         count /= framerateFactor;
         
         if (this.img.error) {
@@ -4954,16 +5070,111 @@ function refreshCameraFrames() {
             this.refreshDivider++;
         }
         else {
-            var cameraId = this.id.substring(6);
             refreshCameraFrame(cameraId, this.img, serverSideResize);
             
             this.refreshDivider = 0;
         }
     });
     
+    if (frameSocket) {
+        var json = JSON.stringify(subscription);
+        if (json != frameSocketSubscription) {
+            frameSocket.send(JSON.stringify({subscribe: subscription}));
+            frameSocketSubscription = json;
+        }
+    }
+    
     setTimeout(refreshCameraFrames, refreshInterval);
 }
 
+function openFrameSocket() {
+    /* a single websocket carries the frames and the status of all the visible cameras;
+     * the cameras are polled one frame at a time when it's not available */
+    if (!window.WebSocket || frameSocket) {
+        return;
+    }
+    
+    var url = (window.location.protocol == 'https:' ? 'wss://' : 'ws://') + window.location.host +
+            addAuthParams('GET', basePath + 'frames/');
+    var socket = new WebSocket(url);
+    var opened = false;
+    socket.binaryType = 'arraybuffer';
+    
+    socket.onopen = function () {
+        opened = true;
+        frameSocket = socket;
+        frameSocketSubscription = null;
+        frameSocketStatus = {};
+    };
+    
+    socket.onclose = function () {
+        if (frameSocket === socket) {
+            frameSocket = null;
+        }
+        frameSocketStatus = {};
+        
+        if (opened) { /* otherwise websockets are not usable here, so stick to polling */
+            setTimeout(openFrameSocket, 5000);
+        }
+    };
+    
+    socket.onmessage = function (event) {
+        if (typeof event.data != 'string') {
+            showSocketFrame(event.data);
+            return;
+        }
+        
+        var data = JSON.parse(event.data);
+        Object.keys(data.status || {}).forEach(function (cameraId) {
+            var status = data.status[cameraId];
+            var cameraStatus = frameSocketStatus[cameraId] = frameSocketStatus[cameraId] || {};
+            
+            /* kept in the same format as the corresponding cookies */
+            if (status.error) {
+                cameraStatus.error = status.error;
+            }
+            if (status.motionDetected != null) {
+                cameraStatus['motion_detected'] = String(status.motionDetected);
+            }
+            if (status.captureFps != null) {
+                cameraStatus['capture_fps'] = status.captureFps.toFixed(1);
+            }
+            if (status.monitorInfo != null) {
+                cameraStatus['monitor_info'] = status.monitorInfo;
+            }
+        });
+    };
+}
+
+function showSocketFrame(buffer) {
+    var cameraId = new DataView(buffer).getUint32(0);
+    if (refreshDisabled[cameraId]) {
+        return;
+    }
+    
+    var img = getCameraFrame(cameraId).find('img.camera')[0];
+    if (!img) {
+        return;
+    }
+    
+    if (img.frameUrl) {
+        URL.revokeObjectURL(img.frameUrl);
+    }
+    
+    img.frameUrl = URL.createObjectURL(new Blob([new Uint8Array(buffer, 4)], {type: 'image/jpeg'}));
+    img.src = img.frameUrl;
+}
+
+function getCameraStatus(cameraId, name) {
+    /* the status received through the frame socket takes precedence over the cookies */
+    var status = frameSocketStatus[cameraId];
+    if (status && status[name] != null) {
+        return status[name];
+    }
+    
+    return getCookie(name + '_' + cameraId);
+}
+
 function checkCameraErrors() {
     /* properly triggers the onerror event on the cameras whose imgs were not successfully loaded,
      * but the onerror event hasn't been triggered, for some reason (seems to happen in Chrome) */
@@ -5015,6 +5226,8 @@ $(document).ready(function () {
     beginProgress();
     
     ajax('GET', basePath + 'login/', null, function () {
+        openFrameSocket();
+        
         if (!frame) {
             fetchCurrentConfig(endProgress);
         }
@@ -16,11 +16,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>. 
 
 import base64
+import ctypes
+import ctypes.util
 import datetime
 import functools
 import hashlib
 import logging
 import os
+import platform
 import re
 import socket
 import sys
@@ -51,6 +54,26 @@ MASK_WIDTH = 32
 
 DEV_NULL = open('/dev/null', 'w')
 
+# the number of the ioprio_set system call on the supported architectures
+_IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'i386': 289,
+    'i486': 289,
+    'i586': 289,
+    'i686': 289,
+    'armv6l': 314,
+    'armv7l': 314,
+    'armv8l': 314,
+    'aarch64': 30,
+    'ppc': 273,
+    'ppc64': 273,
+    'ppc64le': 273
+}
+
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+
 
 COMMON_RESOLUTIONS = [
     (320, 200),
@@ -336,6 +359,27 @@ def get_disk_usage(path):
     return (used_size, total_size)
 
 
+def set_idle_io_priority():
+    '''Puts the calling thread in the idle I/O scheduling class,
+    so that it only gets disk time when no one else needs it.'''
+
+    syscall_nr = _IOPRIO_SET_SYSCALLS.get(platform.machine())
+    if syscall_nr is None:
+        logging.debug('setting the I/O priority is not supported on %s' % platform.machine())
+        return False
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if libc.syscall(syscall_nr, _IOPRIO_WHO_PROCESS, 0, _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT) < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    except Exception as e:
+        logging.warning('failed to set the idle I/O priority: %(msg)s' % {'msg': unicode(e)})
+        return False
+
+    return True
+
+
 def is_local_motion_camera(config):
     '''Tells if a camera is managed by the local motion instance.'''
     return bool(config.get('videodevice') or config.get('netcam_url'))
@@ -0,0 +1,129 @@
+
+# Copyright (c) 2013 Calin Crisan
+# This file is part of motionEye.
+#
+# motionEye is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import logging
+import multiprocessing.pool
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+import settings
+
+
+# a small pool of threads shared by all the blocking media jobs (listing, zipping etc),
+# so that concurrent requests don't fork the whole server once per request
+_pool = None
+
+# a separate pool for the long running background jobs (deleting media groups etc),
+# so that they never hold up the jobs the UI is waiting for
+_background_pool = None
+
+
+class TimeoutError(Exception):
+    pass
+
+
+def start():
+    _get_pool()
+    _get_background_pool()
+
+
+def stop():
+    global _pool
+    global _background_pool
+
+    # running jobs are left to finish by themselves
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+    if _background_pool is not None:
+        _background_pool.close()
+        _background_pool = None
+
+
+def submit(func, timeout, *args, **kwargs):
+    # runs func(*args, **kwargs) in a worker thread; the returned future is resolved on the IO loop,
+    # either with the outcome of the call or with a TimeoutError after timeout seconds;
+    # a job that times out can't be interrupted, but its result is discarded
+    # (its thread stays busy until the job actually ends)
+    return _submit(_get_pool(), func, timeout, *args, **kwargs)
+
+
+def submit_background(func, timeout, *args, **kwargs):
+    # like submit(), but for the jobs that may run for a long time; they are queued
+    # for their own threads, leaving those of submit() free
+    return _submit(_get_background_pool(), func, timeout, *args, **kwargs)
+
+
+def _submit(pool, func, timeout, *args, **kwargs):
+    io_loop = IOLoop.instance()
+    future = Future()
+    name = getattr(func, '__name__', 'job')
+
+    def on_done(result, exception):
+        if future.done(): # timed out
+            logging.debug('discarding the result of timed out worker job %s' % name)
+            return
+
+        io_loop.remove_timeout(timeout_handle)
+        if exception is not None:
+            future.set_exception(exception)
+
+        else:
+            future.set_result(result)
+
+    def on_timeout():
+        if not future.done():
+            future.set_exception(TimeoutError('worker job %s did not finish in %s seconds' % (name, timeout)))
+
+    def run():
+        try:
+            result = func(*args, **kwargs)
+
+        except Exception as e:
+            logging.error('worker job %(name)s failed: %(msg)s' % {'name': name, 'msg': unicode(e)}, exc_info=True)
+            io_loop.add_callback(on_done, None, e)
+
+        else:
+            io_loop.add_callback(on_done, result, None)
+
+    timeout_handle = io_loop.add_timeout(datetime.timedelta(seconds=timeout), on_timeout)
+    pool.apply_async(run)
+
+    return future
+
+
+def _get_pool():
+    global _pool
+
+    if _pool is None:
+        logging.debug('starting %s worker threads' % settings.WORKER_THREADS)
+        _pool = multiprocessing.pool.ThreadPool(settings.WORKER_THREADS)
+
+    return _pool
+
+
+def _get_background_pool():
+    global _background_pool
+
+    if _background_pool is None:
+        logging.debug('starting %s background worker threads' % settings.BACKGROUND_WORKER_THREADS)
+        _background_pool = multiprocessing.pool.ThreadPool(settings.BACKGROUND_WORKER_THREADS)
+
+    return _background_pool